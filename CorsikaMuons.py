@@ -0,0 +1,93 @@
+# This reads the muons of the CORSIKA text files (MuonsNNNNNN) used by
+# "intersect.py". All the 'Muon:' lines of a file are turned into one
+# (n_muons x n_columns) float array in a single pass: the lines are picked out
+# and all their numbers are converted at once by numpy, instead of calling
+# float() on every field.
+# The arrays are cached in a folder as .npy files, each with a small manifest
+# (see "FileManifest.py") that records the size, mtime and hash of the text
+# file it came from. Later runs memory-map the cached array, and a text file
+# is only parsed again if it changed.
+#
+# muons = load_muons(corsika_file)
+#   muons[:,MUON_X], muons[:,MUON_Y]  -> position relative to the core
+#   muons[:,MUON_DIR]                 -> direction (nx,ny,nz)
+
+import os
+import numpy as np
+
+from FileManifest import FileManifest, file_info, make_dirs
+
+
+# where the parsed muons are cached
+muon_cache_location = './data/corsika_cache/'
+
+# the columns of a 'Muon:' line, after the 'Muon:'
+MUON_X   = 0
+MUON_Y   = 1
+MUON_DIR = [3,4,5]
+
+
+
+# This function parses the 'Muon:' lines of a CORSIKA text file
+# returns an (n_muons x n_columns) array with all the numbers of the lines
+def parse_muons(file_name):
+
+    with open(file_name) as f:
+        lines = [line.split(None,1) for line in f]
+    lines = [line[1] for line in lines if len(line) == 2 and line[0] == 'Muon:']
+    if len(lines) == 0:
+        return np.zeros((0,len(MUON_DIR)+3))
+
+    ncolumns = len(lines[0].split())
+    values   = np.fromstring(" ".join(lines),dtype=float,sep=" ")
+    if len(values) == len(lines)*ncolumns:
+        return values.reshape(len(lines),ncolumns)
+
+    # not every line has the same number of columns, keep the ones they all have
+    rows = [line.split() for line in lines]
+    ncolumns = min(len(row) for row in rows)
+    return np.array([row[:ncolumns] for row in rows],dtype=float)
+
+
+
+# This function gives the muons of a CORSIKA text file, from the cache if the
+# file did not change since it was parsed. The cached array is memory-mapped.
+# 'info' is the muon_file_info() of the file if it is already known, so the
+# file is not read again to record it.
+def load_muons(file_name,cache=muon_cache_location,info=None):
+
+    if cache is None:
+        return parse_muons(file_name)
+
+    base       = os.path.join(cache,os.path.basename(file_name))
+    array_name = base+".npy"
+    manifest   = FileManifest(base+".json")
+
+    if manifest.up_to_date(file_name) and os.path.isfile(array_name):
+        return np.load(array_name,mmap_mode='r')
+
+    muons = parse_muons(file_name)
+
+    # the array is complete before the manifest says it is up to date
+    # (the temporary name is per process, in case several parse the file)
+    make_dirs(cache)
+    tmp_name = base+".tmp%d.npy" % os.getpid()
+    np.save(tmp_name,muons)
+    os.rename(tmp_name,array_name)
+    manifest.record(file_name,info)
+    manifest.save()
+
+    return muons
+
+
+
+# This function gives the size, mtime and content hash of a CORSIKA text file
+# (see file_info() in "FileManifest.py"), from the manifest of its cached
+# muons if the file did not change since then
+def muon_file_info(file_name,cache=muon_cache_location):
+    if cache is not None:
+        manifest = FileManifest(os.path.join(cache,os.path.basename(file_name))
+                                                                    +".json")
+        if manifest.up_to_date(file_name):
+            return manifest.get(file_name)
+    return file_info(file_name)
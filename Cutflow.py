@@ -0,0 +1,81 @@
+# This is a small bookkeeping class for the processing scripts. It counts how
+# many frames (or showers, muons, ...) reach each step, and how much wall time
+# is spent in each stage, and saves that as a json summary.
+# The cutflows of several files can be merged into the one of a whole run.
+#
+# cutflow = Cutflow(['seen','passed'])  # counts that are listed even if 0
+# cutflow.count("seen")
+# with cutflow.timer("read"):
+#     frame = i3f.pop_frame()
+# cutflow.save("cutflow.json")
+
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Cutflow:
+
+    def __init__(self,names=()):
+        self.counts = OrderedDict((name,0) for name in names) # name -> count
+        self.times  = OrderedDict() # name -> wall time in seconds
+
+    def count(self,name,n=1):
+        self.counts[name] = self.counts.get(name,0) + n
+
+    def add_time(self,name,seconds):
+        self.times[name] = self.times.get(name,0.) + seconds
+
+    # adds the wall time spent in the 'with' block to the stage 'name'
+    @contextmanager
+    def timer(self,name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name,time.time() - start)
+
+    # adds the counts and times of another cutflow (or of its dictionary)
+    def merge(self,other):
+        if isinstance(other,Cutflow):
+            other = other.to_dict()
+        for name in other['counts']:
+            self.count(name,other['counts'][name])
+        for name in other['times']:
+            self.add_time(name,other['times'][name])
+
+    def to_dict(self):
+        return OrderedDict([('counts',self.counts),('times',self.times)])
+
+    def save(self,file_name,**info):
+        summary = OrderedDict(sorted(info.items()))
+        summary.update(self.to_dict())
+        with open(file_name,'w') as f:
+            json.dump(summary,f,indent=1)
+
+    # the cutflow of a dictionary from to_dict() (e.g. sent back by a worker)
+    @staticmethod
+    def from_dict(summary):
+        cutflow = Cutflow(summary['counts'])
+        cutflow.merge(summary)
+        return cutflow
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name) as f:
+            return Cutflow.from_dict(json.load(f,object_pairs_hook=OrderedDict))
+
+    # one line per count, with the fraction of the first count
+    def summary(self):
+        lines = []
+        first = None
+        for name in self.counts:
+            if first is None:
+                first = max(self.counts[name],1)
+            lines.append("{0:<16}{1:>12}{2:>10.2%}".format(name,
+                                self.counts[name],self.counts[name]/float(first)))
+        for name in self.times:
+            lines.append("{0:<16}{1:>12.2f} s".format(name,self.times[name]))
+        return "\n".join(lines)
@@ -0,0 +1,106 @@
+# This is a small manifest that remembers which input files have already been
+# processed, so scripts only have to redo the files that are new or changed.
+# Every input file is recorded with its size, modification time and a hash of
+# its content, plus whatever the script wants to store with it (e.g. the name
+# of the file that holds its results).
+# A file counts as unchanged if its size and mtime are the same. If only the
+# mtime changed (e.g. the file was copied again) the content hash decides.
+# The manifest is a json file that is replaced in one step when it is saved,
+# so it is never left half written (also when several processes save it).
+
+
+import os
+import json
+import errno
+import hashlib
+
+
+# This function calculates the hash of the content of a file
+def file_hash(file_name,block_size=2**20):
+    h = hashlib.sha1()
+    with open(file_name,'rb') as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+# This function gives the size, modification time and content hash of a file,
+# as they are recorded in a manifest. Worker processes call it on the file
+# they process, so the parent does not read every input file again to record
+# it (see FileManifest.record()).
+def file_info(file_name):
+    stat = os.stat(file_name)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime,
+            'hash': file_hash(file_name)}
+
+
+# This function makes a folder (and its parents) if it is not there yet.
+# Several processes can make the same folder at once.
+def make_dirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+
+# DEFINITION OF THE MANIFEST -------------------------------------------
+# ----------------------------------------------------------------------
+# manifest = FileManifest("./data/shards/manifest.json")
+#   manifest.up_to_date(file_name)         -> True if processed and unchanged
+#   manifest.record(file_name,shard="x")   -> remember the file (and its info)
+#   manifest.record(file_name,entry,...)   -> same, with a file_info() of the
+#                                             file that is already known
+#   manifest.get(file_name)                -> the info stored with the file
+#   manifest.save()                        -> write the manifest to disk
+class FileManifest:
+
+    def __init__(self,path):
+        self.path  = path
+        self.files = dict()
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.files = json.load(f)['files']
+
+    def __contains__(self,file_name):
+        return file_name in self.files
+
+    def get(self,file_name):
+        return self.files[file_name]
+
+    def up_to_date(self,file_name):
+        if file_name not in self.files or not os.path.isfile(file_name):
+            return False
+        entry = self.files[file_name]
+        stat  = os.stat(file_name)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime == entry['mtime']:
+            return True
+        # same size but touched, check if the content really changed
+        if file_hash(file_name) != entry['hash']:
+            return False
+        entry['mtime'] = stat.st_mtime
+        return True
+
+    def record(self,file_name,entry=None,**info):
+        entry = dict(entry) if entry is not None else file_info(file_name)
+        entry.update(info)
+        self.files[file_name] = entry
+
+    def forget(self,file_name):
+        del self.files[file_name]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            make_dirs(directory)
+        tmp_path = self.path+".tmp%d" % os.getpid()
+        with open(tmp_path,'w') as f:
+            json.dump({'files': self.files},f,indent=1,sort_keys=True)
+        os.rename(tmp_path,self.path)
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
@@ -0,0 +1,110 @@
+# This compiles the IceTop part of a GCD file into a small table of arrays, so
+# the scripts don't have to open and decompress the GCD file and look up
+# geometry.omgeo[OMKey] for every DOM, and so the analysis scripts don't need
+# an IceTray environment at all.
+# The table is saved like a shower store (a folder with one .npy per array,
+# see "ShowerStore.py") in ./data/geometry, in a folder named by the hash of
+# the content of the GCD file. A manifest (see "FileManifest.py") records the
+# GCD files (by absolute path) with their hash, so the same path and the same
+# content always give the same table, and a table is compiled again only if
+# its GCD file changes. Only compiling needs IceTray.
+#
+# table = load_geometry_table("./data/GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz")
+#   table['TankIndex']  -> (162) tank index, see TANK_INDEX in "ShowerClass.py"
+#   table['Station']    -> (162) station of each tank
+#   table['Tank']       -> (162) tank number (1 or 2) of each tank
+#   table['DOMPos']     -> (82 x 65 x 3) DOM positions, see dom_positions()
+#   table['TankPos']    -> (162 x 3) tank positions for the lateral distances
+#                          (OM 62 for tank 1 and OM 63 for tank 2)
+#   table['TankCenter'] -> (162 x 3) centers of the tanks, for intersect.py
+#   table['OMKeyIndex'] -> (82 x 65) tank index of every OMKey, -1 if none
+
+import os
+import shutil
+import numpy as np
+
+from FileManifest import FileManifest
+from ShowerClass import NTANKS, TANK_INDEX, dom_positions
+from ShowerStore import save_columns, load_columns, replace_store
+
+
+# where the tables are saved
+geometry_location = './data/geometry/'
+
+
+
+# This function makes the table from the DOM positions (see dom_positions())
+def geometry_table(dom_pos):
+
+    station = np.repeat(np.arange(1,82),2)
+    tank    = np.tile([1,2],81)
+
+    # the lateral distances use OM 62 for tank 1 and OM 63 for tank 2
+    tank_pos = dom_pos[station,tank+61]
+
+    # the center of a tank is the average x,y of its two DOMs (61,62 or
+    # 63,64), and 0.2 below the first DOM because the center of the ice is
+    # below the center of the tank
+    om1 = 61 + 2*(tank-1)
+    center = np.zeros((NTANKS,3))
+    center[:,0] = (dom_pos[station,om1,0] + dom_pos[station,om1+1,0])/2.0
+    center[:,1] = (dom_pos[station,om1,1] + dom_pos[station,om1+1,1])/2.0
+    center[:,2] = dom_pos[station,om1,2] - 0.2
+
+    return {'TankIndex':  np.arange(NTANKS),
+            'Station':    station,
+            'Tank':       tank,
+            'DOMPos':     dom_pos,
+            'TankPos':    tank_pos,
+            'TankCenter': center,
+            'OMKeyIndex': TANK_INDEX.copy()}
+
+
+
+# This function reads the geometry of a GCD file and saves its table
+def compile_geometry(gcd_file,cache=geometry_location):
+    from icecube.dataio import I3File
+
+    geom_file  = I3File(gcd_file)
+    geom_frame = geom_file.pop_frame()
+    geometry   = geom_frame['I3Geometry']
+    geom_file.close()
+
+    table = geometry_table(dom_positions(geometry))
+
+    manifest = FileManifest(os.path.join(cache,"manifest.json"))
+    manifest.record(os.path.abspath(gcd_file))
+
+    # the table is complete before the manifest says it is up to date
+    path     = os.path.join(cache,manifest.get(os.path.abspath(gcd_file))['hash'])
+    tmp_path = path+".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    save_columns(tmp_path,table)
+    replace_store(tmp_path,path)
+    manifest.save()
+
+    return table
+
+
+
+# This function loads the table of a GCD file, and compiles it first if there
+# is none or the GCD file changed. If the GCD file is not there (e.g. on a
+# machine for the analysis only, or in another folder) the table of the GCD
+# file with the same name is used, if there is only one.
+def load_geometry_table(gcd_file,cache=geometry_location):
+    manifest = FileManifest(os.path.join(cache,"manifest.json"))
+    gcd_path = os.path.abspath(gcd_file)
+
+    gcd_hash = None
+    if manifest.up_to_date(gcd_path):
+        gcd_hash = manifest.get(gcd_path)['hash']
+    elif not os.path.isfile(gcd_path):
+        hashes = set(entry['hash'] for name, entry in manifest.files.items()
+                        if os.path.basename(name) == os.path.basename(gcd_path))
+        if len(hashes) == 1:
+            gcd_hash = hashes.pop()
+
+    if gcd_hash is not None and os.path.isdir(os.path.join(cache,gcd_hash)):
+        return load_columns(os.path.join(cache,gcd_hash),mmap=False)
+    return compile_geometry(gcd_file,cache)
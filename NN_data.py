@@ -2,37 +2,37 @@
 
 import numpy as np
 
+from ShowerStore import load_showers
+from Selection import Selection
+
 
 # function that collects the data wanted for use in the neural network
 def process_showers(showers):
+
+    sel = Selection(showers)
+
+    cut_dist = 400
+
+    # tanks far enough from the core that have some charge, and the ones of
+    # those with a charge between 0.6 and 2 VEM
+    tanks  = sel.tanks(("LatDist",">=",cut_dist),"TotalPE != 0")
+    window = tanks & sel.window("TotalVEM",0.6,2.0)
+
+    nMuons    = sel.tank_sum("nMuons",tanks)
+    MuonVEM   = sel.tank_sum("MuonVEM",tanks)
+    TimeDelay = np.where(window,np.abs(sel.field("TimeDelay")),0.).sum(axis=1)
+    Q         = sel.tank_sum("TotalVEM",window)
+
+    Run    = sel.field("Run")
+    Energy = sel.field("Reconstruction.Energy")
+    Zen    = sel.field("Reconstruction.zen")
+    Type   = sel.field("Primary.Type")
+
     List = []
-    for shower in showers:
-        Run    = shower.Run
-        Energy = shower.Reconstruction.Energy
-        Zen    = shower.Reconstruction.zen
-        Type   = shower.Primary.Type
-        
-        cut_dist = 400
-        
-        TimeDelay = 0.
-        Q         = 0.
-        MuonVEM   = 0.
-        nMuons    = 0.
-
-        
-        for i in range(len(shower.Signals.Tank)):
-            if shower.Signals.LatDist[i] >= cut_dist and shower.Signals.TotalPE[i] != 0:
-                totalVEM = shower.Signals.TotalVEM[i]
-                totalPE  = shower.Signals.TotalPE[i]
-                scale    = totalVEM/totalPE
-                scaledPE = scale*shower.Signals.MuonPE[i]
-                nMuons  += shower.Signals.nMuons[i]
-                MuonVEM += scaledPE
-                if totalVEM >= 0.6 and totalVEM <= 2.0:
-                    TimeDelay += np.abs(shower.Signals.TimeDelay[i])
-                    Q += totalVEM
-
-        List.append([Run,Energy,Zen,TimeDelay,Q,MuonVEM,nMuons,Type])
+    for i in range(len(sel)):
+        List.append([int(Run[i]),float(Energy[i]),float(Zen[i]),
+                     float(TimeDelay[i]),float(Q[i]),float(MuonVEM[i]),
+                     float(nMuons[i]),str(Type[i].decode())])
     return List
 
 # function that avarages the NN data for each run
@@ -74,13 +74,13 @@ def avg_runs(List,Type):
 
 
 # first the proton data
-protondata = np.load('./data/proton_showers.npy')
+protondata = load_showers('./data/proton_showers')
 NNdata_proton = process_showers(protondata) # original data
 del protondata # to save memory
 NNdata_proton_avg = avg_runs(NNdata_proton,"PPlus") # average by run number
 
 # now the iron data
-irondata = np.load('./data/iron_showers.npy')
+irondata = load_showers('./data/iron_showers')
 NNdata_iron = process_showers(irondata) # original data
 del irondata # to save memory
 NNdata_iron_avg = avg_runs(NNdata_iron,'Fe56Nucleus') # average by run number
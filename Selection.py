@@ -0,0 +1,142 @@
+# This is the selection engine of the analysis scripts. Instead of looping over
+# the showers and their 162 tanks, the cuts are applied to whole columns of a
+# shower store (see "ShowerStore.py") at once, and give boolean masks:
+#   - event masks, one value per shower, e.g. for an energy window
+#   - tank masks, an (n_events x 162) matrix, e.g. for the tanks far enough
+#     from the core that have some charge. The event cuts given with them are
+#     applied to every tank of the event.
+#
+# A cut is a string "field op value" or a tuple (field, op, value), with op one
+# of <, <=, >, >=, ==, !=. A field is the name of a column (e.g. Run,
+# Primary.Energy, Signals.LatDist), a tank field without "Signals." (e.g.
+# LatDist), or one of the derived fields in DERIVED (e.g. logE, MuonVEM).
+#
+# sel    = Selection(load_showers("./data/proton_showers"))
+# events = sel.events("logE >= 15.5","logE < 16")
+# tanks  = sel.tanks("LatDist >= 300","TotalPE > 0",events=events)
+# muon   = sel.tank_sum("MuonVEM",tanks & sel.window("MuonVEM",0.6,2.0))
+
+import re
+import numpy as np
+
+from ShowerStore import ShowerStore, showers_to_columns
+
+
+# the comparison operators of the cuts
+OPS = {'<':  np.less,
+       '<=': np.less_equal,
+       '>':  np.greater,
+       '>=': np.greater_equal,
+       '==': np.equal,
+       '!=': np.not_equal}
+
+CUT_PATTERN = re.compile(r'^\s*([\w.]+)\s*(<=|>=|==|!=|<|>)\s*(\S+)\s*$')
+
+
+
+# the charge of a tank from muons (or other particles) in VEM: the PE scaled
+# by (total VEM)/(total PE), 0 for tanks without PE
+def _scaled_pe(c,name):
+    total_pe = np.asarray(c['Signals.TotalPE'])
+    with np.errstate(divide='ignore',invalid='ignore'):
+        scaled = np.asarray(c['Signals.TotalVEM'])/total_pe*np.asarray(c[name])
+    return np.where(total_pe != 0,scaled,0.)
+
+# The fields that are calculated from the columns
+DERIVED = {'logE':     lambda c: np.log10(np.asarray(c['Primary.Energy'])),
+           'CosZen':   lambda c: np.cos(np.asarray(c['Primary.zen'])),
+           'MuonVEM':  lambda c: _scaled_pe(c,'Signals.MuonPE'),
+           'OtherVEM': lambda c: _scaled_pe(c,'Signals.OtherPE')}
+
+
+
+# This function turns a cut string into a (field, op, value) tuple
+def parse_cut(cut):
+    if not isinstance(cut,str):
+        return tuple(cut)
+    match = CUT_PATTERN.match(cut)
+    if match is None:
+        raise ValueError("Can't read the cut '"+cut+"'")
+    field, op, value = match.groups()
+    return field, op, float(value)
+
+
+
+
+# DEFINITION OF THE SELECTION --------------------------------------------
+# ------------------------------------------------------------------------
+# sel = Selection(store)  (a ShowerStore, or an old array of Shower objects)
+#   sel.field(name)                    -> the array of a field
+#   sel.events(*cuts)                  -> event mask of the event cuts
+#   sel.tanks(*cuts,events=mask)       -> tank mask of event and tank cuts
+#   sel.window(name,low,high,closed)   -> low <= field <= high (or < ... <)
+#   sel.tank_sum(name,mask)            -> per event sum of the tanks in mask
+#   sel.values(name,mask)              -> values of the tanks in mask, in order
+class Selection:
+
+    def __init__(self,data):
+        if isinstance(data,ShowerStore):
+            self.columns = data.columns
+        elif isinstance(data,dict):
+            self.columns = data
+        else:
+            self.columns = showers_to_columns(list(data))
+        self.derived = dict() # derived fields that were calculated
+
+    def __len__(self):
+        return len(self.columns['Run'])
+
+    def field(self,name):
+        if name in self.columns:
+            return self.columns[name]
+        if "Signals."+name in self.columns:
+            return self.columns["Signals."+name]
+        if name in DERIVED:
+            if name not in self.derived:
+                self.derived[name] = DERIVED[name](self.columns)
+            return self.derived[name]
+        raise KeyError("No field '"+name+"' in the showers")
+
+    # the mask of one cut, per event or per tank depending on the field
+    def cut(self,cut):
+        field, op, value = parse_cut(cut)
+        if op not in OPS:
+            raise ValueError("Unknown operator '"+op+"'")
+        with np.errstate(invalid='ignore'):
+            return OPS[op](np.asarray(self.field(field)),value)
+
+    def events(self,*cuts):
+        mask = np.ones(len(self),dtype=bool)
+        for cut in cuts:
+            m = self.cut(cut)
+            if m.ndim != 1:
+                raise ValueError("'"+str(cut)+"' is not a cut on events")
+            mask &= m
+        return mask
+
+    # event cuts (and the 'events' mask) apply to all the tanks of the event
+    def tanks(self,*cuts,**kwargs):
+        mask = np.ones((len(self),self.columns['Signals.LatDist'].shape[1]),
+                                                                    dtype=bool)
+        events = kwargs.get('events')
+        if events is not None:
+            mask &= np.asarray(events,dtype=bool)[:,None]
+        for cut in cuts:
+            m = self.cut(cut)
+            mask &= m[:,None] if m.ndim == 1 else m
+        return mask
+
+    # closed=True gives low <= field <= high, closed=False low < field < high
+    def window(self,name,low,high,closed=True):
+        if closed:
+            return self.cut((name,'>=',low)) & self.cut((name,'<=',high))
+        return self.cut((name,'>',low)) & self.cut((name,'<',high))
+
+    def tank_sum(self,name,mask):
+        return np.where(mask,self.field(name),0.).sum(axis=1)
+
+    def values(self,name,mask):
+        return np.asarray(self.field(name))[mask]
+
+# ------------------------------------------------------------------------
+# ------------------------------------------------------------------------
@@ -51,6 +51,7 @@ class Signals:
         self.SLCVEM    = []
         self.TotalVEM  = []   
         self.nMuons    = []
+        self.TrackLength = [] # muon track length in the tank (m), see intersect.py
         self.TimeDelay = []
 
 # ----------------------------------------------------------------------
@@ -59,6 +60,30 @@ class Signals:
 
 
 
+# Tanks are indexed 0..161 in the same order as their sorted names
+# ("Station01_Tank1", "Station01_Tank2", ..., "Station81_Tank2"), i.e.
+# index = 2*(station-1) + (tank-1)
+NTANKS = 162
+
+# This function calculates the lateral distance of every tank for every shower
+# in one go. tank_pos is the (162,3) array of tank positions (TankPos in
+# "GeometryCache.py": OM 62 for tank 1, OM 63 for tank 2), cores is an
+# (n,3) array of shower cores and axes an (n,3) array of shower directions.
+# A single core/axis of shape (3,) is also accepted.
+# Returns an (n,162) array of lateral distances.
+def lateral_distances(tank_pos,cores,axes):
+
+    cores = np.atleast_2d(np.asarray(cores,dtype=float))
+    axes  = np.atleast_2d(np.asarray(axes,dtype=float))
+
+    R    = tank_pos[np.newaxis,:,:] - cores[:,np.newaxis,:] # core -> tank
+    d2   = np.einsum('ntk,ntk->nt',R,R) # squared distance from shower core
+    proj = np.einsum('ntk,nk->nt',R,axes) # projection on the shower axis
+
+    return np.sqrt(np.maximum(d2 - proj**2,0)) # distance from shower axis
+
+
+
 # This function is used to calculate lateral distances
 def LatDist(xc,yc,zc,N,key,geometry):
 
@@ -95,6 +120,144 @@ def which_tank(key):
 
 
 
+# Lookup table from OMKey to tank index, indexed as TANK_INDEX[string,om].
+# Entries that are not IceTop tank DOMs are -1.
+# note: OMs 61,62 are in tank 1, OMs 63,64 are in tank 2
+TANK_INDEX = -np.ones((82,65),dtype=int)
+for _s in range(1,82):
+    TANK_INDEX[_s,61:63] = 2*(_s-1)
+    TANK_INDEX[_s,63:65] = 2*(_s-1)+1
+
+# This function gives the Station/Tank name of a tank index, for printing
+def tank_name(index):
+    return "Station{0:02d}_Tank{1}".format(index//2+1,index%2+1)
+
+# the names of all the tanks, in tank index order
+TANK_NAMES = [tank_name(i) for i in range(NTANKS)]
+
+
+
+# This function flattens a list of pulse series maps (one per component,
+# e.g. muon, electron, HLC, ...) into arrays with one entry per pulse:
+# the string and OM of the DOM, the tank index, the pulse time and charge,
+# and the component (the position of its map in the list)
+def flatten_pulses(pulse_maps):
+
+    strings    = []
+    oms        = []
+    times      = []
+    charges    = []
+    components = []
+    for c in range(len(pulse_maps)):
+        for key, pulses in pulse_maps[c]:
+            n = len(pulses)
+            strings.extend([key.string]*n)
+            oms.extend([key.om]*n)
+            times.extend([p.time for p in pulses])
+            charges.extend([p.charge for p in pulses])
+            components.extend([c]*n)
+
+    strings = np.array(strings,dtype=int)
+    oms     = np.array(oms,dtype=int)
+    return {'string':    strings,
+            'om':        oms,
+            'tank':      TANK_INDEX[strings,oms],
+            'time':      np.array(times,dtype=float),
+            'charge':    np.array(charges,dtype=float),
+            'component': np.array(components,dtype=int)}
+
+
+
+# This function applies the pulse cuts to flattened pulses (positive charge,
+# within 'window' ns of the core time tcr) and sums the charges that pass per
+# tank and per component.
+# Returns the (162 x ncomponents) charge matrix, the number of pulses that
+# passed per component, and the mask of the pulses that passed.
+def accumulate_pulses(pulses,tcr,ncomponents,window=1000):
+
+    mask = (pulses['charge'] > 0) & (np.abs(tcr - pulses['time']) <= window)
+
+    tank = pulses['tank'][mask]
+    comp = pulses['component'][mask]
+
+    charges = np.bincount(tank*ncomponents + comp,
+                          weights=pulses['charge'][mask],
+                          minlength=NTANKS*ncomponents)
+    counts  = np.bincount(comp,minlength=ncomponents)
+
+    return charges.reshape(NTANKS,ncomponents), counts, mask
+
+
+
+# This function builds an array of DOM positions indexed as [string,om],
+# for the IceTop DOMs (OMs 61-64 of strings 1-81). Other entries are NaN.
+def dom_positions(geometry):
+    from icecube import icetray
+
+    dom_pos = np.nan*np.ones((82,65,3))
+    for i in range(1,82):
+        for j in range(61,65):
+            pos = geometry.omgeo[icetray.OMKey(i,j)].position
+            dom_pos[i,j] = [pos.x, pos.y, pos.z]
+    return dom_pos
+
+
+
+# This function calculates the time delays of many pulses at once, it is the
+# same calculation as time_delay below. pos is the (n,3) array of the
+# positions of the DOMs of the pulses and tpulse the array of pulse times.
+def time_delays(tcr,xc,yc,zc,N,pos,tpulse):
+
+    # direction of the shower
+    nx,ny,nz = N
+
+    # location of the DOMs
+    xi = pos[:,0]
+    yi = pos[:,1]
+    zi = pos[:,2]
+
+    c = 0.3 # speed of light (m/ns)
+
+    return tcr + nx*(xi-xc)+ny*(yi-yc) - np.sqrt(1-nx**2-ny**2)*(zi-zc)/c - tpulse
+
+
+
+# This function picks one time delay per tank when a tank has several pulses
+# The policies are:
+#   'last'     - the delay of the last pulse in the list
+#   'earliest' - the delay of the pulse with the earliest time
+#   'weighted' - the charge-weighted mean of the delays
+# Tanks without pulses get a time delay of 0
+TIME_POLICIES = ['last','earliest','weighted']
+
+def reduce_time_delays(tank,tdelay,tpulse,charge,policy='last'):
+
+    result = np.zeros(NTANKS)
+    if len(tank) == 0:
+        return result
+
+    if policy == 'last':
+        # first occurrence of each tank in the reversed list
+        tanks, first = np.unique(tank[::-1],return_index=True)
+        result[tanks] = tdelay[::-1][first]
+    elif policy == 'earliest':
+        # sort by tank, then by time, and take the first pulse of every tank
+        order = np.lexsort((tpulse,tank))
+        tanks, first = np.unique(tank[order],return_index=True)
+        result[tanks] = tdelay[order][first]
+    elif policy == 'weighted':
+        weights = np.bincount(tank,weights=charge,minlength=NTANKS)
+        sums    = np.bincount(tank,weights=charge*tdelay,minlength=NTANKS)
+        hit     = weights > 0
+        result[hit] = sums[hit]/weights[hit]
+    else:
+        raise ValueError("Unknown time delay policy '"+str(policy)+
+                         "', use one of "+", ".join(TIME_POLICIES))
+
+    return result
+
+
+
 # This function calculates the time delay of a signal
 def time_delay(tcr,xc,yc,zc,N,key,geometry,tpulse):
     
@@ -147,7 +310,7 @@ def print_table(self,dist):
         if s.TotalPE[i] + s.TotalVEM[i] != 0:
             if s.LatDist[i] >= dist:
                 print "{0:<18}{1:>10.2f}{2:>14.0f}{3:>12.0f}{4:>12.0f}{5:>12.2f}{6:>12.2f}{7:>12.2f}{8:>8.0f}{9:>16.3f}".format(
-                    s.Tank[i],s.LatDist[i],s.MuonPE[i],s.OtherPE[i],s.TotalPE[i],s.HLCVEM[i],s.SLCVEM[i],s.TotalVEM[i],s.nMuons[i],s.TimeDelay[i])
+                    tank_name(i),s.LatDist[i],s.MuonPE[i],s.OtherPE[i],s.TotalPE[i],s.HLCVEM[i],s.SLCVEM[i],s.TotalVEM[i],s.nMuons[i],s.TimeDelay[i])
 
 
     # Bottom frame
@@ -0,0 +1,473 @@
+# This is a columnar, memory-mappable on-disk format for the showers made by
+# "Showers.py". Instead of one pickled array of Shower objects, a shower file
+# is a folder with one .npy file per field:
+#   - per-event arrays, e.g. Run.npy, Primary.Energy.npy, Reconstruction.zen.npy
+#   - (n_events x 162) per-tank matrices, e.g. Signals.LatDist.npy
+# The tanks are in tank index order (see TANK_INDEX in ShowerClass.py).
+# Loading only maps the files into memory, so it is near-instant and the
+# memory use does not grow with the size of the dataset.
+# ShowerStore also hands out Shower objects on demand, so old code that loops
+# over showers (and Shower.Table()) keeps working.
+# ShardWriter writes the showers of every input file to its own shard as soon
+# as the file is done, and joins the shards into the final stores at the end.
+# Every store has an index from (Run, Event) to the row of the shower, in the
+# folder 'index' of the store, so single showers and runs are found without
+# reading the rest.
+
+
+import os
+import time
+import shutil
+import numpy as np
+
+from ShowerClass import Shower, NTANKS, TANK_NAMES
+from FileManifest import FileManifest
+
+
+# THE FIELDS THAT ARE STORED -------------------------------------------
+# ----------------------------------------------------------------------
+EVENT_FIELDS   = ['Run','Event','TotalMuons','nMuonPulses']
+PRIMARY_FIELDS = ['Type','Energy','x','y','z','zen']
+TANK_FIELDS    = ['LatDist','MuonPE','OtherPE','TotalPE','HLCVEM','SLCVEM',
+                  'TotalVEM','nMuons','TrackLength','TimeDelay']
+
+# integer fields, missing values (None) are stored as -1
+# every other numeric field is a float, with missing values stored as NaN
+INT_FIELDS = ['Run','Event','TotalMuons','nMuonPulses','Signals.nMuons']
+
+# the two parts of a shower that hold Primary attributes
+PRIMARY_PARTS = ['Primary','Reconstruction']
+
+# width of the primary type strings, e.g. "Fe56Nucleus"
+TYPE_LENGTH = 16
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+
+
+
+# This function gives the names of all the columns in a shower store
+def column_names():
+    names = list(EVENT_FIELDS)
+    for part in PRIMARY_PARTS:
+        names += [part+"."+field for field in PRIMARY_FIELDS]
+    names += ["Signals."+field for field in TANK_FIELDS]
+    return names
+
+
+
+# This function writes a dictionary of arrays to a folder, one .npy per array
+def save_columns(path,columns):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name in columns:
+        np.save(os.path.join(path,name+".npy"),columns[name])
+
+
+
+# This function loads all the .npy files in a folder into a dictionary
+# by default the arrays are memory-mapped instead of read into memory
+def load_columns(path,mmap=True):
+    mode = 'r' if mmap else None
+    # follow the link of a store once (see replace_store()), so all the
+    # columns come from the same version even if it is replaced meanwhile
+    path = os.path.realpath(path)
+    columns = dict()
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(".npy"):
+            columns[file_name[:-4]] = np.load(os.path.join(path,file_name),
+                                                            mmap_mode=mode)
+    return columns
+
+# This function loads one column of a folder, None if it is not there
+def load_column(path,name,mmap=True):
+    file_name = os.path.join(path,name+".npy")
+    if not os.path.isfile(file_name):
+        return None
+    return np.load(file_name,mmap_mode='r' if mmap else None)
+
+
+
+# This function turns a list of Shower objects into columns
+def showers_to_columns(showers):
+
+    n = len(showers)
+    columns = dict()
+
+    # event-level fields
+    for field in EVENT_FIELDS:
+        columns[field] = np.array([_fill(getattr(s,field),field)
+                                        for s in showers],dtype=np.int64)
+
+    # primary and reconstruction
+    for part in PRIMARY_PARTS:
+        for field in PRIMARY_FIELDS:
+            name = part+"."+field
+            values = [getattr(getattr(s,part),field) for s in showers]
+            if field == 'Type':
+                values = [v if v is not None else "" for v in values]
+                columns[name] = np.array(values,dtype='S'+str(TYPE_LENGTH))
+            else:
+                columns[name] = np.array([_fill(v,name) for v in values],
+                                                            dtype=np.float64)
+
+    # tank-level fields, missing ones are filled like missing values
+    for field in TANK_FIELDS:
+        name = "Signals."+field
+        if name in INT_FIELDS:
+            matrix = -np.ones((n,NTANKS),dtype=np.int64)
+        else:
+            matrix = np.zeros((n,NTANKS),dtype=np.float64) + np.nan
+        for i in range(n):
+            values = getattr(showers[i].Signals,field,[])
+            if len(values) > 0:
+                # older files can have the muon numbers appended after the
+                # placeholder -1's, in that case the last 162 are the real ones
+                matrix[i] = values[-NTANKS:]
+        columns[name] = matrix
+
+    return columns
+
+# replaces a missing value with the fill value of the column
+def _fill(value,name):
+    if value is not None:
+        return value
+    if name in INT_FIELDS:
+        return -1
+    return np.nan
+
+
+
+# This function selects rows (events) of all the columns with a mask or
+# a list of indices
+def select_rows(columns,rows):
+    return dict((name,np.asarray(columns[name])[rows]) for name in columns)
+
+
+
+# This function saves the columns of showers as a shower store, with its
+# index. The store is written to a temporary folder and then put in place of
+# an old one (see replace_store()), so readers never see it half written.
+def save_store(path,columns):
+    path     = path.rstrip('/')
+    tmp_path = path+".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    save_columns(tmp_path,columns)
+    save_index(tmp_path,columns['Run'],columns['Event'])
+    replace_store(tmp_path,path)
+
+# This function saves a list of Shower objects as a shower store
+def save_showers(path,showers):
+    save_store(path,showers_to_columns(showers))
+
+
+
+# THE (RUN, EVENT) INDEX -----------------------------------------------
+# ----------------------------------------------------------------------
+# The index is two arrays in the folder 'index' of a store:
+#   Keys.npy -> the keys of all the showers, sorted, see event_key()
+#   Rows.npy -> the row of the shower of each key
+# so a shower is found with a binary search of the (memory-mapped) keys.
+
+# the key of a (Run, Event), keys sort by run first, then event
+def event_key(run,event):
+    return np.asarray(run,dtype=np.int64)*2**32 + np.asarray(event,dtype=np.int64)
+
+def build_index(run,event):
+    keys = event_key(run,event)
+    rows = np.argsort(keys,kind='mergesort')
+    return keys[rows], rows
+
+def save_index(path,run,event):
+    keys, rows = build_index(run,event)
+    save_columns(os.path.join(path,"index"),{'Keys': keys, 'Rows': rows})
+
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+
+
+
+# This function loads showers as a ShowerStore. An old pickled .npy file
+# (e.g. ./data/proton_showers.npy, given with or without the .npy) is
+# converted once into a store in the folder of the same name without .npy,
+# later calls load that store.
+def load_showers(path):
+    if path.endswith(".npy"):
+        path = path[:-4]
+    if not os.path.isdir(path) and os.path.isfile(path+".npy"):
+        convert_showers(path+".npy",path)
+    return ShowerStore(path)
+
+# This function converts an old pickled array of Shower objects into a store
+def convert_showers(file_name,path):
+    print "Converting",file_name,"to a shower store in",path
+    showers = np.load(file_name,allow_pickle=True)
+    save_showers(path,list(showers))
+
+
+
+
+# DEFINITION OF THE SHOWER STORE -----------------------------------------
+# ------------------------------------------------------------------------
+# store = ShowerStore("./data/proton_showers")
+#   store.column("Primary.Energy")  -> memory-mapped array of all energies
+#   store.column("Signals.LatDist") -> (n_events x 162) memory-mapped matrix
+#   store[i]                        -> Shower object of event i
+#   for shower in store: ...        -> Shower objects, made one at a time
+#   store.find(run,event)           -> row of a shower, None if not there
+#   store.event(run,event)          -> Shower object of a shower, e.g. to
+#                                      look at it with .Table()
+#   store.select_runs(runs)         -> rows of all the showers of the runs
+class ShowerStore:
+
+    def __init__(self,path,mmap=True):
+        # the link of the store is followed once, so the columns and the
+        # index come from the same version (see replace_store())
+        self.path    = os.path.realpath(path)
+        self.columns = load_columns(self.path,mmap)
+        self.index   = None
+
+    # the index of the store, stores written before there was an index (or
+    # with a stale one) get one in memory
+    def _index(self):
+        if self.index is None:
+            index_path = os.path.join(self.path,"index")
+            if os.path.isdir(index_path):
+                index = load_columns(index_path)
+                if len(index['Keys']) == len(self):
+                    self.index = index['Keys'], index['Rows']
+            if self.index is None:
+                self.index = build_index(self.columns['Run'],self.columns['Event'])
+        return self.index
+
+    def find(self,run,event):
+        keys, rows = self._index()
+        key = event_key(run,event)
+        i = np.searchsorted(keys,key)
+        if i < len(keys) and keys[i] == key:
+            return int(rows[i])
+        return None
+
+    def event(self,run,event):
+        i = self.find(run,event)
+        return self.shower(i) if i is not None else None
+
+    # the rows are in store order
+    def select_runs(self,runs):
+        keys, rows = self._index()
+        runs = np.unique(np.asarray(runs,dtype=np.int64))
+        if len(runs) == 0:
+            return np.zeros(0,dtype=int)
+        # the keys of a run go from (run,0) to (run,2**32-1), event IDs are
+        # unsigned 32 bit
+        start = np.searchsorted(keys,event_key(runs,0))
+        stop  = np.searchsorted(keys,event_key(runs+1,0))
+        return np.sort(np.concatenate([rows[a:b] for a,b in zip(start,stop)]))
+
+    def __len__(self):
+        return len(self.columns['Run'])
+
+    def column(self,name):
+        return self.columns[name]
+
+    def __getitem__(self,i):
+        return self.shower(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.shower(i)
+
+    # build the Shower object of event i
+    def shower(self,i):
+        c = self.columns
+        shower = Shower()
+
+        for field in EVENT_FIELDS:
+            setattr(shower,field,_value(c[field][i],field))
+
+        for part in PRIMARY_PARTS:
+            primary = getattr(shower,part)
+            for field in PRIMARY_FIELDS:
+                name = part+"."+field
+                value = c[name][i]
+                if field == 'Type':
+                    if not isinstance(value,str):
+                        value = value.decode()
+                    primary.Type = str(value) if value != "" else None
+                else:
+                    setattr(primary,field,_value(value,name))
+
+        shower.Signals.Tank = TANK_NAMES
+        for field in TANK_FIELDS:
+            # stores made before a field was added don't have it
+            if "Signals."+field in c:
+                setattr(shower.Signals,field,c["Signals."+field][i].tolist())
+
+        return shower
+
+# turns a stored value back into a python value, with None for missing values
+def _value(value,name):
+    if name in INT_FIELDS:
+        return None if value == -1 else int(value)
+    return None if np.isnan(value) else float(value)
+
+# ------------------------------------------------------------------------
+# ------------------------------------------------------------------------
+
+
+
+
+# This function puts a finished store in place of an old one.
+# The new store is written to a temporary folder first, which becomes a
+# version folder next to 'path' (e.g. proton_showers.v<time>_<pid>), and
+# 'path' is a symlink to the current version. The link is swapped in one
+# rename, so readers see either the complete old store or the complete new
+# store, and 'path' always exists. The old versions are deleted afterwards
+# (readers that already mapped their files keep them).
+def replace_store(tmp_path,path):
+    path    = path.rstrip('/')
+    folder  = os.path.dirname(path) or "."
+    base    = os.path.basename(path)
+    version = base+".v%d_%d" % (int(time.time()*1e6),os.getpid())
+    os.rename(tmp_path,os.path.join(folder,version))
+
+    # a store from before the links is a folder, a link can't replace it
+    # in one step, so it is moved aside first (only once)
+    if os.path.isdir(path) and not os.path.islink(path):
+        os.rename(path,path+".old")
+
+    link = os.path.join(folder,"."+version+".link")
+    os.symlink(version,link)
+    os.rename(link,path)
+
+    for name in os.listdir(folder):
+        if name == base+".old" or (name.startswith(base+".v") and
+                                                    name != version):
+            shutil.rmtree(os.path.join(folder,name))
+
+
+
+
+# DEFINITION OF THE SHARD WRITER -----------------------------------------
+# ------------------------------------------------------------------------
+# The showers of each input file are saved as a small store (a shard) in
+# the folder 'path', and manifest.json (see "FileManifest.py") records which
+# input files are done, with their size, mtime and content hash.
+# A rerun that uses the same folder only redoes the files that are new or
+# have changed since their shard was written.
+#
+# writer = ShardWriter("./data/shards")
+#   writer.done(file_name,tag)             -> True if the shard is up to date
+#   writer.add(file_name,columns,tag,info) -> save the showers of a file
+#   writer.prune(file_names)               -> drop shards of other files
+#   writer.consolidate(files,path,select)  -> join the shards into one store
+class ShardWriter:
+
+    def __init__(self,path):
+        self.path     = path
+        self.manifest = FileManifest(os.path.join(path,"manifest.json"))
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # remove shards that were not finished (e.g. the run crashed while
+        # writing them), they are not in the manifest
+        shards = set(entry['shard'] for entry in self.manifest.files.values())
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path,name)) and name not in shards:
+                shutil.rmtree(os.path.join(path,name))
+
+    # 'tag' can describe what was taken from the file (e.g. which frames),
+    # the shard is only up to date if the tag is the same
+    def done(self,file_name,tag=None):
+        return self.manifest.up_to_date(file_name) and \
+                            self.manifest.get(file_name).get('tag') == tag
+
+    def shard_path(self,file_name):
+        return os.path.join(self.path,self.manifest.get(file_name)['shard'])
+
+    # save the showers of an input file, then record it in the manifest
+    # 'info' is the file_info() of the input file (see "FileManifest.py"),
+    # from the worker that processed it
+    # a changed file gets a new shard name, so the old shard stays valid
+    # until the manifest points to the new one
+    def add(self,file_name,columns,tag=None,info=None):
+        old   = self.manifest.get(file_name)['shard'] \
+                                    if file_name in self.manifest else None
+        shard = os.path.basename(file_name)
+        if shard == old:
+            shard += ".new"
+        save_columns(os.path.join(self.path,shard),columns)
+        self.manifest.record(file_name,info,shard=shard,tag=tag)
+        self.manifest.save()
+        if old is not None:
+            shutil.rmtree(os.path.join(self.path,old))
+
+    # forget the input files that are not in 'file_names' (e.g. they were
+    # removed from the data folder), and delete their shards
+    def prune(self,file_names):
+        keep = set(file_names)
+        gone = [f for f in self.manifest.files if f not in keep]
+        for file_name in gone:
+            shard = self.shard_path(file_name)
+            self.manifest.forget(file_name)
+            self.manifest.save()
+            shutil.rmtree(shard)
+
+    # join the shards of the given input files (in that order) into a store
+    # at 'path'. 'select' is an optional function that takes the columns
+    # 'select_fields' of a shard (read into memory) and gives a mask of the
+    # showers to keep.
+    # The store is filled one column at a time, and only that column of each
+    # shard is open while it is copied, so memory and the number of open
+    # files stay flat however many shards there are.
+    def consolidate(self,file_names,path,select=None,
+                                            select_fields=['Primary.Type']):
+
+        shards = [self.shard_path(f) for f in file_names]
+        rows   = []
+        for shard in shards:
+            if select is None:
+                rows.append(np.ones(len(load_column(shard,'Run',mmap=False)),
+                                                                    dtype=bool))
+            else:
+                c = dict((name,load_column(shard,name,mmap=False))
+                                                    for name in select_fields)
+                rows.append(np.asarray(select(c),dtype=bool))
+        n = sum(int(r.sum()) for r in rows)
+
+        tmp_path = path+".tmp"
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        template = showers_to_columns([])
+        for name in column_names():
+            file_name = os.path.join(tmp_path,name+".npy")
+            shape = (n,) + template[name].shape[1:]
+            if n == 0:
+                np.save(file_name,np.zeros(shape,dtype=template[name].dtype))
+                continue
+            out = np.lib.format.open_memmap(file_name,mode='w+',
+                                    dtype=template[name].dtype,shape=shape)
+            start = 0
+            for shard,r in zip(shards,rows):
+                column = load_column(shard,name)
+                if column is not None:
+                    values = np.asarray(column[r])
+                else: # a shard made before the field was added
+                    values = showers_to_columns([Shower()]*int(r.sum()))[name]
+                del column
+                out[start:start+len(values)] = values
+                start += len(values)
+            out.flush()
+            del out
+
+        save_index(tmp_path,load_column(tmp_path,'Run',mmap=False),
+                            load_column(tmp_path,'Event',mmap=False))
+
+        replace_store(tmp_path,path)
+
+# ------------------------------------------------------------------------
+# ------------------------------------------------------------------------
@@ -3,12 +3,27 @@
 # This script takes I3 simulation files and and stores relevant data (plus some 
 # meta data) in the Shower data structure, defined in ShowerClass.py. The data 
 # is saved in the data folder.
-# Note that it stores all the data during run and then saves it all at the end. 
-# Thus you can use the current data structures in the data folder while this 
-# program is running. At the end of execution, this program will then update 
-# those files with the new data. This also means if you accidently run this
-# script, you can just cancel it before completion and nothing will happen to
-# the current data
+# The showers of every file are saved in a shard in ./data/shards as soon as
+# the file is done, so memory does not grow with the number of files. A rerun
+# only processes the files that are new or changed since their shard was made,
+# so adding a few files is quick, and a stopped (or crashed) run resumes after
+# the last finished file (use --fresh to start over). Only at the end are the
+# shards joined into the shower files, which replace the old ones in one step.
+# Thus you can use the current data structures in the data folder while this
+# program is running, and they are never left half written.
+#
+# The files can be processed in parallel with the --jobs option, e.g.
+#   ./Showers.py --jobs 16
+# Each worker process loads the geometry table (see "GeometryCache.py") and
+# returns the showers of one file as columns. The results are merged in sorted
+# file order, so the output is identical to a serial run.
+#
+# With --event-list the frames listed by "quality_cuts.py --event-list" are
+# read straight from the original files, instead of from filtered I3 files.
+#
+# The cutflow (frames read, showers saved, and the time spent reading and
+# extracting) of every file and of the whole run is saved as json next to
+# the shards (see "Cutflow.py")
 
 # ------------------------------------------------------------------------------
 # make sure IceTray environment is active
@@ -21,243 +36,414 @@ if not 'I3_BUILD' in os.environ:
 
 import numpy as np
 import glob
-
-from ShowerClass import Shower, LatDist, which_tank, time_delay
+import time
+import shutil
+import hashlib
+import argparse
+from multiprocessing import Pool
+
+from ShowerClass import Shower, \
+                        lateral_distances, flatten_pulses, accumulate_pulses, \
+                        time_delays, reduce_time_delays, TIME_POLICIES, \
+                        NTANKS, TANK_NAMES
+from ShowerStore import showers_to_columns, ShardWriter
+from FileManifest import file_info
+from Cutflow import Cutflow
+from GeometryCache import load_geometry_table
+from quality_cuts import read_frames, event_location, event_list_frames
 
 from icecube.dataio import I3File
 from icecube import icetray, dataclasses, recclasses, simclasses
 
 #data files location
 data_location = './data/i3files/'
+# where the shower files are saved
+save_location = './data/'
+# where the showers of each file are saved while the script runs
+shard_location = './data/shards/'
+# the same when the frames are read with an event list
+event_shard_location = './data/shards_events/'
+# geometry file
+geom_location = "./data/GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz"
+
+# the pulse series that are read from every frame, the positions in this list
+# are the components used in accumulate_pulses (see "ShowerClass.py")
+PULSE_SERIES = ['IceTopComponentPulses_Muon',
+                'IceTopComponentPulses_Electron',
+                'IceTopComponentPulses_ElectronFromChargedMesons',
+                'IceTopComponentPulses_Gamma',
+                'IceTopComponentPulses_GammaFromChargedMesons',
+                'IceTopComponentPulses_Hadron',
+                'OfflineIceTopHLCVEMPulses',
+                'OfflineIceTopSLCVEMPulses']
+MUON  = 0
+OTHER = [1,2,3,4,5]
+HLC   = 6
+SLC   = 7
+
+# the tank and DOM positions, set by load_geometry() in every process, and
+# the time delay policy and the frames of the event list (if there is one, per
+# input file), set by setup()
+tank_pos     = None
+dom_pos      = None
+time_policy  = 'last'
+event_frames = None
 
-# get geometry info
-geom_file  = I3File("./data/GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz")
-geom_frame = geom_file.pop_frame()
-geometry   = geom_frame['I3Geometry']
-geom_file.close()
 
 
-# arrays to hold all the showers
-ProtonData = []
-IronData   = []
+# ------------------------------------------------------------------------------
+# Geometry ---------------------------------------------------------------------
+# ------------------------------------------------------------------------------
 
+# get geometry info, from the compiled table of the GCD file (see
+# "GeometryCache.py")
+def load_geometry():
+    global tank_pos, dom_pos
 
-# --------------------------------------------------------------------------
-# Now get the data from the files -------------------------------------------
+    # tank positions used for the lateral distances, and the DOM positions
+    # used for the time delays
+    table    = load_geometry_table(geom_location)
+    tank_pos = table['TankPos']
+    dom_pos  = table['DOMPos']
 
-# list of appropriate files in folder
-files = glob.glob(data_location + 'Level2*')
 
-# loop through files
-nfiles = len(files)
-for file_number in range(nfiles):
 
-    file_name = files[file_number]
-    i3f = I3File(file_name)
+# set the options and load the geometry, this is also the initializer of the
+# worker processes
+def setup(policy,frames=None):
+    global time_policy, event_frames
+    time_policy  = policy
+    event_frames = frames
+    load_geometry()
 
-    print "Starting",file_name,"(file",file_number+1,"of "+str(nfiles)+")"
 
-    while i3f.more():
 
-        frame = i3f.pop_physics()
-        
-        # new instance of the Shower data structure (see "ShowerClass.py")
-        shower = Shower()
-
-        header = frame["I3EventHeader"]
-        shower.Run   = header.run_id
-        shower.Event = header.event_id
-
-        # ----------------------------------------------------------------------
-        # Primary particle truth data ------------------------------------------
-        # ----------------------------------------------------------------------
-        MCPrim = frame["MCPrimary"]
-
-        shower.Primary.Type   = MCPrim.type_string
-        shower.Primary.Energy = MCPrim.energy*10**9
-
-        xc  = shower.Primary.x = MCPrim.pos.x
-        yc  = shower.Primary.y = MCPrim.pos.y
-        zc  = shower.Primary.z = MCPrim.pos.z
-        zen = shower.Primary.zen = MCPrim.dir.zenith # in radians
-        azi = MCPrim.dir.azimuth # in radians
-
-        # shower direction
-        nx = -np.sin(zen)*np.cos(azi)
-        ny = -np.sin(zen)*np.sin(azi)
-        nz = -np.cos(zen)
-        N  = [nx,ny,nz]
-
-        tcr = MCPrim.time # I will accept signals within 1000 ns of this
-
-
-        # ----------------------------------------------------------------------
-        # Signals --------------------------------------------------------------
-        # ----------------------------------------------------------------------
-
-        # First I make a dictionary, with an entry for every tank
-        # Each entry contains the station number and the tank number
-        # note: OMs 61,62 are in tank 1, OMs 63,64 are in tank 2
-
-        Signals_dict = dict()
-
-        # Fill the dictionary with tank names, and their lateral distances
-        # I also leave 7 empty entries in an array to hold the signal data below
-        for i in range(1,10):
-            for j in [1,2]:
-                tank = "Station0"+str(i)+"_Tank"+str(j)
-                Signals_dict[tank] = np.zeros(8)
-                key = icetray.OMKey(i,j+61)
-                Signals_dict[tank][0] = LatDist(xc,yc,zc,N,key,geometry)
-
-        for i in range(10,82):
-            for j in [1,2]:
-                tank = "Station"+str(i)+"_Tank"+str(j)
-                Signals_dict[tank] = np.zeros(8)
-                key = icetray.OMKey(i,j+61)
-                Signals_dict[tank][0] = LatDist(xc,yc,zc,N,key,geometry)
-
-        # --------------------
-        # Muon Pulses --------
-        # --------------------
-
-        muonpulse = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                                'IceTopComponentPulses_Muon')
-        
-        nMuonPulses = 0
-        MuonPulses = []
-
-        for key, pulses in muonpulse:
-            for p in pulses:
-                if p.charge > 0 and np.abs(tcr - p.time) <= 1000:
-                    nMuonPulses += 1
-                    tank = which_tank(key) # get the name of the tank w/ OMKey
-                    Signals_dict[tank][1] += p.charge 
-
-        shower.nMuonPulses = nMuonPulses
-
-        # --------------------
-        # Other Pulses -------
-        # --------------------
-
-        electronpulse = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                            'IceTopComponentPulses_Electron')
-        electronmesonpulse = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                            'IceTopComponentPulses_ElectronFromChargedMesons')
-        gammapulse = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                                'IceTopComponentPulses_Gamma')
-        gammamesonpulse = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                'IceTopComponentPulses_GammaFromChargedMesons')
-        hadronpulse = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                                'IceTopComponentPulses_Hadron')
-
-        Other_pulses= [electronpulse,electronmesonpulse,gammapulse,
-                                                    gammamesonpulse,hadronpulse]
-
-        for O in Other_pulses:
-            for key, pulses in O:
-                for p in pulses:
-                    if p.charge > 0 and np.abs(tcr - p.time) <= 1000:
-                        tank = which_tank(key)  # get the name of the tank
-                        Signals_dict[tank][2] += p.charge 
-
-        # Add the total number of photoelectrons
-        for tank in Signals_dict:
-            Signals_dict[tank][3]= Signals_dict[tank][1] + Signals_dict[tank][2]
-
-        # --------------------
-        # HLC & SLC Signals --
-        # --------------------
-
-        # HLC data --
-        events_HLC  = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                                    'OfflineIceTopHLCVEMPulses')
-        for key, pulses in events_HLC:
-            for p in pulses:
-                if p.charge > 0 and np.abs(tcr - p.time) <= 1000:
-                    tank = which_tank(key)
-                    Signals_dict[tank][4] += p.charge
-                    tpulse = p.time
-                    tdelay = time_delay(tcr,xc,yc,zc,N,key,geometry,tpulse) 
-                    Signals_dict[tank][7] = tdelay 
-
-        events_SLC  = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,
-                                                    'OfflineIceTopSLCVEMPulses')
-
-        # SLC data --
-        for key, pulses in events_SLC:
-            for p in pulses:
-                if p.charge > 0 and np.abs(tcr - p.time) <= 1000:
-                    tank = which_tank(key)
-                    Signals_dict[tank][5] += p.charge
-                    tpulse = p.time
-                    tdelay = time_delay(tcr,xc,yc,zc,N,key,geometry,tpulse)
-                    Signals_dict[tank][7] = tdelay   
-
-        # add the total signal in VEM
-        for tank in Signals_dict:
-            Signals_dict[tank][6]= Signals_dict[tank][4] + Signals_dict[tank][5]
-
-        # ------------------------
-        # Add Signals to Shower --
-        # ------------------------
-        for tank in sorted(Signals_dict):
-            shower.Signals.Tank.append(tank)
-            shower.Signals.LatDist.append(Signals_dict[tank][0])
-            shower.Signals.MuonPE.append(Signals_dict[tank][1])
-            shower.Signals.OtherPE.append(Signals_dict[tank][2])
-            shower.Signals.TotalPE.append(Signals_dict[tank][3])
-            shower.Signals.HLCVEM.append(Signals_dict[tank][4])
-            shower.Signals.SLCVEM.append(Signals_dict[tank][5])
-            shower.Signals.TotalVEM.append(Signals_dict[tank][6])
-            shower.Signals.nMuons.append(-1)
-            shower.Signals.TimeDelay.append(Signals_dict[tank][7])
-
-
-        # ----------------------------------------------------------------------
-        # Reconstruction -------------------------------------------------------
-        # ----------------------------------------------------------------------
-
-        Laputop = frame["LaputopStandard"]
-        LaputopParams = recclasses.I3LaputopParams.from_frame(frame,"LaputopStandardParams")
-        shower.Reconstruction.x = Laputop.pos.x
-        shower.Reconstruction.y = Laputop.pos.y
-        shower.Reconstruction.z = Laputop.pos.z   
-        shower.Reconstruction.zen = Laputop.dir.zenith
-        shower.Reconstruction.Energy = LaputopParams.energy(recclasses.LaputopEnergy.ICRC2015_H4a_E27)*10**9
-        
-        """
-        shower.Reconstruction.E_Proton = LaputopParams.e_proton*10**9
-        shower.Reconstruction.E_Iron = LaputopParams.e_iron*10**9
-        shower.Reconstruction.x = Laputop.pos.x
-        shower.Reconstruction.y = Laputop.pos.y
-        shower.Reconstruction.z = Laputop.pos.z
-        shower.Reconstruction.zen = Laputop.dir.zenith
-        shower.Reconstruction.S500 = LaputopParams.s500
-        """
-        
-        # ----------------------------------------------------------------------
-        # Save Shower ----------------------------------------------------------
-        # ----------------------------------------------------------------------
-
-        if shower.Primary.Type == "PPlus":
-            ProtonData.append(shower)
-        elif shower.Primary.Type == "Fe56Nucleus":
-            IronData.append(shower)
-        else:
-            print "ATTENTION: Run",shower.Run,"Event",shower.Event, \
-                                    "has primary of type",shower.Primary.Type
-            print "It will not be saved in the data files"
+# ------------------------------------------------------------------------------
+# Extract the shower data from a physics frame ---------------------------------
+# ------------------------------------------------------------------------------
 
+def extract_shower(frame):
+
+    # new instance of the Shower data structure (see "ShowerClass.py")
+    shower = Shower()
+
+    header = frame["I3EventHeader"]
+    shower.Run   = header.run_id
+    shower.Event = header.event_id
+
+    # ----------------------------------------------------------------------
+    # Primary particle truth data ------------------------------------------
+    # ----------------------------------------------------------------------
+    MCPrim = frame["MCPrimary"]
+
+    shower.Primary.Type   = MCPrim.type_string
+    shower.Primary.Energy = MCPrim.energy*10**9
+
+    xc  = shower.Primary.x = MCPrim.pos.x
+    yc  = shower.Primary.y = MCPrim.pos.y
+    zc  = shower.Primary.z = MCPrim.pos.z
+    zen = shower.Primary.zen = MCPrim.dir.zenith # in radians
+    azi = MCPrim.dir.azimuth # in radians
+
+    # shower direction
+    nx = -np.sin(zen)*np.cos(azi)
+    ny = -np.sin(zen)*np.sin(azi)
+    nz = -np.cos(zen)
+    N  = [nx,ny,nz]
+
+    tcr = MCPrim.time # I will accept signals within 1000 ns of this
+
+
+    # ----------------------------------------------------------------------
+    # Signals --------------------------------------------------------------
+    # ----------------------------------------------------------------------
+
+    # First I make a signal matrix, with a row for every tank
+    # The rows are in tank index order (see TANK_INDEX in ShowerClass.py)
+    # note: OMs 61,62 are in tank 1, OMs 63,64 are in tank 2
+
+    # Column 0 holds the lateral distances of the tanks
+    # I also leave 7 empty columns to hold the signal data below
+    Signals_arr = np.zeros((NTANKS,8))
+    Signals_arr[:,0] = lateral_distances(tank_pos,[xc,yc,zc],N)[0]
+
+    # --------------------
+    # Pulses -------------
+    # --------------------
+
+    # all the pulse series are flattened into one set of arrays, and the
+    # pulses within 1000 ns of the core time are summed per tank and component
+    pulse_maps = [dataclasses.I3RecoPulseSeriesMap.from_frame(frame,name)
+                                                    for name in PULSE_SERIES]
+    pulses = flatten_pulses(pulse_maps)
+    charges, counts, passed = accumulate_pulses(pulses,tcr,len(PULSE_SERIES))
+
+    # Muon pulses
+    Signals_arr[:,1]   = charges[:,MUON]
+    shower.nMuonPulses = int(counts[MUON])
+
+    # Other pulses
+    Signals_arr[:,2] = charges[:,OTHER].sum(axis=1)
+
+    # Add the total number of photoelectrons
+    Signals_arr[:,3] = Signals_arr[:,1] + Signals_arr[:,2]
+
+    # HLC & SLC signals
+    Signals_arr[:,4] = charges[:,HLC]
+    Signals_arr[:,5] = charges[:,SLC]
+
+    # time delays of all the HLC/SLC pulses, a tank with several pulses gets
+    # one delay, chosen by the time policy (see reduce_time_delays)
+    vem    = passed & (pulses['component'] >= HLC)
+    pos    = dom_pos[pulses['string'][vem],pulses['om'][vem]]
+    tpulse = pulses['time'][vem]
+    tdelay = time_delays(tcr,xc,yc,zc,N,pos,tpulse)
+    Signals_arr[:,7] = reduce_time_delays(pulses['tank'][vem],tdelay,tpulse,
+                                          pulses['charge'][vem],time_policy)
+
+    # add the total signal in VEM
+    Signals_arr[:,6] = Signals_arr[:,4] + Signals_arr[:,5]
+
+    # ------------------------
+    # Add Signals to Shower --
+    # ------------------------
+    shower.Signals.Tank      = TANK_NAMES # shared list, only used to print
+    shower.Signals.LatDist   = Signals_arr[:,0].tolist()
+    shower.Signals.MuonPE    = Signals_arr[:,1].tolist()
+    shower.Signals.OtherPE   = Signals_arr[:,2].tolist()
+    shower.Signals.TotalPE   = Signals_arr[:,3].tolist()
+    shower.Signals.HLCVEM    = Signals_arr[:,4].tolist()
+    shower.Signals.SLCVEM    = Signals_arr[:,5].tolist()
+    shower.Signals.TotalVEM  = Signals_arr[:,6].tolist()
+    shower.Signals.nMuons    = [-1]*NTANKS
+    shower.Signals.TrackLength = [np.nan]*NTANKS
+    shower.Signals.TimeDelay = Signals_arr[:,7].tolist()
+
+
+    # ----------------------------------------------------------------------
+    # Reconstruction -------------------------------------------------------
+    # ----------------------------------------------------------------------
+
+    Laputop = frame["LaputopStandard"]
+    LaputopParams = recclasses.I3LaputopParams.from_frame(frame,"LaputopStandardParams")
+    shower.Reconstruction.x = Laputop.pos.x
+    shower.Reconstruction.y = Laputop.pos.y
+    shower.Reconstruction.z = Laputop.pos.z   
+    shower.Reconstruction.zen = Laputop.dir.zenith
+    shower.Reconstruction.Energy = LaputopParams.energy(recclasses.LaputopEnergy.ICRC2015_H4a_E27)*10**9
+    
+    """
+    shower.Reconstruction.E_Proton = LaputopParams.e_proton*10**9
+    shower.Reconstruction.E_Iron = LaputopParams.e_iron*10**9
+    shower.Reconstruction.x = Laputop.pos.x
+    shower.Reconstruction.y = Laputop.pos.y
+    shower.Reconstruction.z = Laputop.pos.z
+    shower.Reconstruction.zen = Laputop.dir.zenith
+    shower.Reconstruction.S500 = LaputopParams.s500
+    """
+
+    return shower
 
 
 
-# save the data
 
-save_location = './data/'
+# ------------------------------------------------------------------------------
+# Process one file -------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# the counts of the cutflow of a file
+CUTFLOW_COUNTS = ['seen','showers']
+
+# returns the showers of the file as columns (see "ShowerStore.py"), which are
+# much cheaper to send back from a worker process than Shower objects, and
+# the cutflow of the file (as a dictionary, see "Cutflow.py"), and the
+# file_info() of the file for the manifest of the shards
+# With an event list, only the listed frames of the file are read.
+def process_file(args):
 
-np.save(save_location+'proton_showers.npy',ProtonData)
-np.save(save_location+'iron_showers.npy',IronData)
+    file_number, nfiles, file_name = args
 
+    print "Starting",file_name,"(file",file_number+1,"of "+str(nfiles)+")"
+
+    cutflow = Cutflow(CUTFLOW_COUNTS)
+    start   = time.time()
+    info    = file_info(file_name)
+
+    if event_frames is not None:
+        frames = read_frames(file_name,event_frames[file_name])
+    else:
+        frames = physics_frames(file_name)
+
+    showers = []
+    while True:
+        with cutflow.timer('read'):
+            frame = next(frames,None)
+        if frame is None:
+            break
+        cutflow.count('seen')
+        with cutflow.timer('extract'):
+            showers.append(extract_shower(frame))
+        cutflow.count('showers')
+
+    columns = showers_to_columns(showers)
+    cutflow.add_time('total',time.time() - start)
+    return columns, cutflow.to_dict(), info
+
+# the physics frames of a file
+def physics_frames(file_name):
+    i3f = I3File(file_name)
+    while i3f.more():
+        yield i3f.pop_physics()
+    i3f.close()
 
 
+
+# ------------------------------------------------------------------------------
+# Process a list of files ------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# This function processes a list of files with 'process' (a function like
+# process_file) and saves the showers. 'initializer(*initargs)' is run first,
+# in every worker process when jobs > 1.
+# The showers of every finished file are saved right away in a shard in
+# 'shards', and only new or changed files are processed (see "ShowerStore.py")
+# 'tags' optionally gives a tag per file (see ShardWriter in "ShowerStore.py")
+# 'process' returns the columns, the cutflow and the file_info() (see
+# "FileManifest.py") of a file, so the parent does not read the files again
+# to record them. The cutflow of each file is saved in 'shards' next to its
+# shard, and the cutflow of the run (all the files, including the ones that
+# were not processed again) in 'shards'/cutflow.json
+def extract_files(files,process,initializer,initargs,shards,jobs=1,fresh=False,
+                                                                    tags=None):
+
+    if tags is None:
+        tags = dict()
+
+    start   = time.time()
+    cutflow = Cutflow()
+
+    if fresh and os.path.isdir(shards):
+        shutil.rmtree(shards)
+    writer = ShardWriter(shards)
+
+    # only new or changed files need to be processed, the others already
+    # have an up to date shard (from an earlier or an interrupted run)
+    writer.prune(files)
+    todo   = [f for f in files if not writer.done(f,tags.get(f))]
+    nfiles = len(todo)
+    tasks  = [(i,nfiles,todo[i]) for i in range(nfiles)]
+    if len(todo) < len(files):
+        print "Reusing the shards of",len(files)-len(todo),"unchanged files"
+    done = set(files) - set(todo)
+    for file_name in files:
+        if file_name in done and os.path.isfile(cutflow_path(shards,file_name)):
+            cutflow.merge(Cutflow.load(cutflow_path(shards,file_name)))
+
+    # loop through files, the results come back in file order
+    if jobs > 1:
+        pool    = Pool(jobs,initializer=initializer,initargs=initargs)
+        results = iter(pool.imap(process,tasks,chunksize=1))
+    else:
+        initializer(*initargs)
+        results = (process(task) for task in tasks)
+
+    for file_name in todo:
+        columns, file_cutflow, info = next(results)
+        Types = columns['Primary.Type']
+        for i in np.where((Types != b"PPlus") & (Types != b"Fe56Nucleus"))[0]:
+            print "ATTENTION: Run",columns['Run'][i],"Event",columns['Event'][i], \
+                                        "has primary of type",Types[i]
+            print "It will not be saved in the data files"
+        writer.add(file_name,columns,tags.get(file_name),info)
+
+        file_cutflow = Cutflow.from_dict(file_cutflow)
+        file_cutflow.save(cutflow_path(shards,file_name),file=file_name)
+        cutflow.merge(file_cutflow)
+
+    if jobs > 1:
+        pool.close()
+        pool.join()
+
+    # --------------------------------------------------------------------------
+    # Save Showers -------------------------------------------------------------
+    # --------------------------------------------------------------------------
+
+    # join the shards, the new files replace the old ones in one step
+    with cutflow.timer('save'):
+        writer.consolidate(files,save_location+'proton_showers',
+                            select=lambda c: c['Primary.Type'] == b"PPlus")
+        writer.consolidate(files,save_location+'iron_showers',
+                            select=lambda c: c['Primary.Type'] == b"Fe56Nucleus")
+
+    # the times of the files add up the time of every worker, 'run' is the
+    # wall time of this run
+    cutflow.add_time('run',time.time() - start)
+    cutflow.save(os.path.join(shards,"cutflow.json"),files=len(files),
+                                            processed=len(todo),jobs=jobs)
+    print "-------------------------"
+    print cutflow.summary()
+
+# where the cutflow of one input file is kept
+def cutflow_path(shards,file_name):
+    return os.path.join(shards,os.path.basename(file_name)+".cutflow.json")
+
+# This function gives the tag of the shard of a file (see ShardWriter in
+# "ShowerStore.py"): the options its showers were made with, and the hash of
+# the frames that were read if it is an event list. A shard made with other
+# options is made again.
+def shard_tag(frames=None,**options):
+    tag = ",".join(name+"="+str(options[name]) for name in sorted(options))
+    if frames is not None:
+        tag += ",frames="+hashlib.sha1(np.asarray(frames,dtype=np.int64)
+                                                    .tobytes()).hexdigest()
+    return tag
+
+
+
+# ------------------------------------------------------------------------------
+# MAIN -------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Extract the IceTop showers "+
+                                        "from the I3 files in "+data_location)
+    parser.add_argument('--jobs',type=int,default=1,
+                        help="number of files processed in parallel")
+    parser.add_argument('--fresh',action='store_true',
+                        help="ignore the shards of a previous run")
+    parser.add_argument('--time-policy',default='last',choices=TIME_POLICIES,
+                        help="which pulse gives the time delay of a tank "+
+                             "with several pulses (default: last)")
+    parser.add_argument('--event-list',nargs='?',const=event_location,
+                        help="read the frames of an event list (made by "+
+                             "quality_cuts.py --event-list) from the input "+
+                             "files, instead of the files in "+data_location)
+    args = parser.parse_args()
+
+    if args.event_list is None:
+        # list of appropriate files in folder, sorted so the output does not
+        # depend on the order the files are listed in
+        files  = sorted(glob.glob(data_location + 'Level2*'))
+        frames = None
+        shards = shard_location
+    else:
+        # the input files of the event list
+        frames = event_list_frames(args.event_list)
+        files  = sorted(frames)
+        shards = event_shard_location
+
+    # a shard is only up to date if it was made with the same time policy
+    # (and from the same frames of its file, for an event list)
+    tags = dict((f,shard_tag(frames[f] if frames is not None else None,
+                             time_policy=args.time_policy)) for f in files)
+
+    # compile the geometry table once, before the workers load it
+    load_geometry_table(geom_location)
+
+    extract_files(files,process_file,setup,(args.time_policy,frames),
+                  shards,jobs=args.jobs,fresh=args.fresh,tags=tags)
+
+
+if __name__ == '__main__':
+    main()
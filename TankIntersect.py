@@ -0,0 +1,249 @@
+# This is the muon-tank intersection used by "intersect.py". Instead of testing
+# one muon against one tank at a time, all the muons of a shower are
+# tested against all the tanks in one broadcast (muons x tanks) computation.
+# A track is a line (not a ray): inclined tracks hit if they cross the tank
+# cylinder between its top and bottom, vertical tracks hit if they are inside
+# its radius.
+# A muon is given to the first tank (in the order of the tank table) it hits.
+#
+# hit = intersect_tanks(pos,dirs,tank_pos)
+#   pos      -> (n_muons x 3) positions of the muons
+#   dirs     -> (n_muons x 3) directions of the muons
+#   tank_pos -> (n_tanks x 3) centers of the tanks
+#   hit      -> index of the tank each muon hits, -1 if it misses all of them
+# TankGrid gives the same result, but only tests the tanks near each muon.
+#
+# With lengths=True the length of the track inside the tank it hits (the chord
+# through the cylinder, entering or leaving through the top, bottom or side)
+# is given too, 0 for muons that miss:
+# hit, length = intersect_tanks(pos,dirs,tank_pos,lengths=True)
+
+import numpy as np
+
+
+# tank dimensions
+TANK_RADIUS = 1.82/2.0+0.01 # meters
+TANK_HEIGHT = 0.90+0.02 # meters
+
+# how many muons are tested at once, this keeps the (muons x tanks) arrays small
+CHUNK = 4096
+
+
+
+# This function tests every muon against every tank, all arrays broadcast
+# against each other (e.g. muons in a column and tanks in a row).
+# rx,ry,rz are the muon positions relative to the tank centers.
+# The comparisons are negated (e.g. ~(arg <= 0) instead of arg > 0), so a
+# NaN counts as a hit like in a loop that tests one muon and one tank.
+# With lengths=True it also gives the track lengths inside the tanks.
+def tank_hits(rx,ry,rz,nx,ny,nz,radius=TANK_RADIUS,height=TANK_HEIGHT,
+                                                                lengths=False):
+
+    zTop    = 0.5*height
+    zBottom = -0.5*height
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+
+        # Inclined tracks
+        nn  = nx**2 + ny**2
+        arg = nn*radius**2 - (nx*ry - ny*rx)**2
+
+        # times and z-coordinates of cylinder intersections (t1 < t2)
+        t1 = (-(rx*nx + ry*ny) - np.sqrt(arg))/nn
+        t2 = (-(rx*nx + ry*ny) + np.sqrt(arg))/nn
+        z1 = rz + nz*t1
+        z2 = rz + nz*t2
+
+        # hit unless the cylinder is missed, or the intersections are both
+        # above or both below the tank
+        inclined = ~(arg <= 0) & \
+                   ~((z1 > zTop) & (z2 > zTop)) & \
+                   ~((z1 < zBottom) & (z2 < zBottom))
+
+        # Vertical tracks
+        vertical = ~(np.sqrt(rx**2 + ry**2) >= radius)
+
+        hits = np.where(nn > 0,inclined,vertical)
+        if not lengths:
+            return hits
+
+        # times where the track is at the bottom and the top of the tank,
+        # the track is in the tank between t1,t2 and between those two
+        tb = (zBottom - rz)/nz
+        tt = (zTop - rz)/nz
+        t_in  = np.maximum(t1,np.minimum(tb,tt))
+        t_out = np.minimum(t2,np.maximum(tb,tt))
+        # horizontal tracks that hit are between the top and bottom all along
+        t_in  = np.where(nz == 0,t1,t_in)
+        t_out = np.where(nz == 0,t2,t_out)
+        chord = np.maximum(t_out - t_in,0.)*np.sqrt(nn + nz**2)
+
+        # vertical tracks that hit go through the whole height
+        length = np.where(hits,np.where(nn > 0,chord,height),0.)
+
+        return hits, length
+
+
+
+# This function gives the index of the first tank each muon hits, or -1
+# (and with lengths=True the track length in that tank)
+def intersect_tanks(pos,dirs,tank_pos,chunk=CHUNK,lengths=False):
+
+    pos      = np.asarray(pos,dtype=float).reshape(-1,3)
+    dirs     = np.asarray(dirs,dtype=float).reshape(-1,3)
+    tank_pos = np.asarray(tank_pos,dtype=float).reshape(-1,3)
+
+    hit    = -np.ones(len(pos),dtype=int)
+    length = np.zeros(len(pos))
+    if len(tank_pos) == 0:
+        return (hit, length) if lengths else hit
+    for start in range(0,len(pos),chunk):
+        p = pos[start:start+chunk]
+        n = dirs[start:start+chunk]
+
+        hits, chords = tank_hits(p[:,0,None] - tank_pos[None,:,0],
+                                 p[:,1,None] - tank_pos[None,:,1],
+                                 p[:,2,None] - tank_pos[None,:,2],
+                                 n[:,0,None],n[:,1,None],n[:,2,None],
+                                 lengths=True)
+
+        # the first tank that is hit
+        first = np.argmax(hits,axis=1)
+        hit[start:start+chunk]    = np.where(hits.any(axis=1),first,-1)
+        length[start:start+chunk] = chords[np.arange(len(p)),first]
+
+    return (hit, length) if lengths else hit
+
+
+
+# This function counts the muons that hit each tank, from intersect_tanks()
+# (or sums 'weights' per tank, e.g. the track lengths)
+def count_hits(hit,ntanks,weights=None):
+    if weights is not None:
+        weights = np.asarray(weights)[hit >= 0]
+    return np.bincount(hit[hit >= 0],weights=weights,minlength=ntanks)
+
+
+
+
+# DEFINITION OF THE TANK GRID --------------------------------------------
+# ------------------------------------------------------------------------
+# A uniform grid over the (x,y) positions of the tanks, so each muon is only
+# tested against the tanks near its track instead of all of them.
+# A track that hits a tank passes within the tank radius of its axis at a
+# height inside the tank, so at the height z0 of the grid it is within
+#   radius + tan(theta)*(|z_tank - z0| + height/2)
+# of the tank center. The tanks in the (up to 2x2) cells that cover that
+# distance around the track at z0 are the candidates, and only they get the
+# exact test of tank_hits(). Tracks that are too inclined for the cells
+# (the distance is more than half a cell) are tested against all the tanks.
+# The result is exactly the same as intersect_tanks().
+#
+# grid = TankGrid(tank_pos)
+#   grid.intersect(pos,dirs)  -> like intersect_tanks(pos,dirs,tank_pos)
+
+# size of the grid cells in meters, the two tanks of a station are ~10m apart
+GRID_CELL = 20.
+
+class TankGrid:
+
+    def __init__(self,tank_pos,cell=GRID_CELL):
+        self.tank_pos = np.asarray(tank_pos,dtype=float).reshape(-1,3)
+        self.cell     = float(cell)
+
+        x = self.tank_pos[:,0]
+        y = self.tank_pos[:,1]
+        z = self.tank_pos[:,2]
+        self.x0 = x.min() if len(x) > 0 else 0.
+        self.y0 = y.min() if len(y) > 0 else 0.
+        self.nx = int(np.floor((x.max() - self.x0)/self.cell)) + 1 if len(x) > 0 else 1
+        self.ny = int(np.floor((y.max() - self.y0)/self.cell)) + 1 if len(y) > 0 else 1
+
+        # the height of the grid, and how far above or below it a track can
+        # hit a tank
+        self.z0 = z.mean() if len(z) > 0 else 0.
+        self.dz = np.abs(z - self.z0).max() + 0.5*TANK_HEIGHT if len(z) > 0 else 0.
+
+        # the tanks of every cell, in tank order, padded with -1
+        cells  = self._cells(x,y)
+        counts = np.bincount(cells,minlength=self.nx*self.ny)
+        self.table = -np.ones((self.nx*self.ny,max(counts.max(),1)),dtype=int)
+        for c in np.unique(cells):
+            tanks = np.where(cells == c)[0]
+            self.table[c,:len(tanks)] = tanks
+
+    # the cell of each (x,y), clipped to the grid
+    def _cells(self,x,y):
+        ix = np.clip(np.floor((x - self.x0)/self.cell),0,self.nx-1).astype(int)
+        iy = np.clip(np.floor((y - self.y0)/self.cell),0,self.ny-1).astype(int)
+        return ix*self.ny + iy
+
+    # the candidate tanks of every muon (padded with -1), and which muons
+    # are too inclined for the grid
+    def candidates(self,pos,dirs):
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            # where the track is at the height of the grid
+            t  = (self.z0 - pos[:,2])/dirs[:,2]
+            nn = dirs[:,0]**2 + dirs[:,1]**2
+            x  = pos[:,0] + np.where(nn > 0,dirs[:,0]*t,0.)
+            y  = pos[:,1] + np.where(nn > 0,dirs[:,1]*t,0.)
+
+            # how far from the track a tank it hits can be, with a mm to spare
+            tan_theta = np.where(nn > 0,np.sqrt(nn)/np.abs(dirs[:,2]),0.)
+            margin    = TANK_RADIUS + tan_theta*self.dz + 1e-3
+            wide      = ~(margin <= 0.5*self.cell) | ~np.isfinite(x) | \
+                                                    ~np.isfinite(y)
+            x = np.where(wide,self.x0,x)
+            y = np.where(wide,self.y0,y)
+
+        # the cells around (x-margin,y-margin), a square of half a cell (or
+        # less) fits in 2x2 cells
+        lx = x - np.where(wide,0.,margin)
+        ly = y - np.where(wide,0.,margin)
+        cells = [self._cells(lx + i*self.cell,ly + j*self.cell)
+                                            for i in [0,1] for j in [0,1]]
+        cand = np.concatenate([self.table[c] for c in cells],axis=1)
+        return cand, wide
+
+    def intersect(self,pos,dirs,chunk=CHUNK,lengths=False):
+
+        pos  = np.asarray(pos,dtype=float).reshape(-1,3)
+        dirs = np.asarray(dirs,dtype=float).reshape(-1,3)
+
+        hit    = -np.ones(len(pos),dtype=int)
+        length = np.zeros(len(pos))
+        if len(self.tank_pos) == 0:
+            return (hit, length) if lengths else hit
+        for start in range(0,len(pos),chunk):
+            p = pos[start:start+chunk]
+            n = dirs[start:start+chunk]
+
+            cand, wide = self.candidates(p,n)
+            t = self.tank_pos[cand]
+            hits, chords = tank_hits(p[:,0,None] - t[:,:,0],
+                                     p[:,1,None] - t[:,:,1],
+                                     p[:,2,None] - t[:,:,2],
+                                     n[:,0,None],n[:,1,None],n[:,2,None],
+                                     lengths=True)
+            hits &= (cand >= 0)
+
+            # the first tank (in tank order) that is hit
+            ntanks = len(self.tank_pos)
+            first  = np.where(hits,cand,ntanks).min(axis=1)
+            column = np.argmax(hits & (cand == first[:,None]),axis=1)
+            chord  = np.where(first < ntanks,chords[np.arange(len(p)),column],0.)
+            first  = np.where(first < ntanks,first,-1)
+
+            # the muons that are too inclined are tested against all the tanks
+            if wide.any():
+                first[wide], chord[wide] = intersect_tanks(p[wide],n[wide],
+                                                    self.tank_pos,lengths=True)
+
+            hit[start:start+chunk]    = first
+            length[start:start+chunk] = chord
+
+        return (hit, length) if lengths else hit
+
+# ------------------------------------------------------------------------
+# ------------------------------------------------------------------------
@@ -2,209 +2,446 @@
 
 # This code takes an icetop shower, matches it to its corsika file, then
 # calculates how many muons hit IceTop (and where). It then stores this info in
-# the shower object as shower.Signals.nMuons
+# the shower object as shower.Signals.nMuons, and the summed length of the muon
+# tracks in every tank (in meters) as shower.Signals.TrackLength
 
-# First is a function that determines whether a muon intersects a tank, given
-# the muon's position and direction and the tank position
-# Afterwards is the main part of the code that loops through the showers
+# The muons are counted with a TankGrid (see "TankIntersect.py"), which tests
+# all the muons of a shower at once, and only against the tanks near each muon.
+# The main part of the code loops through the showers.
+# The cutflow (showers, muons and hits, and the time spent reading the CORSIKA
+# files and intersecting) is saved in ./data/cutflow_intersect.json
+#
+# The showers can be processed in parallel with the --jobs option, e.g.
+#   ./intersect.py --jobs 16
+# The muon numbers come back in the order of the showers, so the output is
+# identical to a serial run.
+#
+# With --resample N, the muons of every shower are instead thrown at N random
+# cores (uniform in a disk around the center of IceTop), to study how much the
+# muon numbers fluctuate. The CORSIKA file is read once for all the throws.
+# The muon numbers of every throw are saved in ./data/resampled (see main())
+#
+# The muon numbers and track lengths of every shower are cached in
+# ./data/intersect_cache, keyed by the content of the CORSIKA file, the core
+# position and the tank geometry. A rerun only computes the showers that are
+# new (or whose CORSIKA file, core or geometry changed), the others come from
+# the cache (use --no-cache to compute everything again).
+#
+# The tank positions come from the compiled geometry table of the GCD file
+# (see "GeometryCache.py"), so no IceTray environment is needed once the table
+# is there.
 
 import numpy as np
+import os
 import glob
+import time
+import shutil
+import hashlib
+import argparse
+from multiprocessing import Pool
 
-from icecube.dataio import I3File
-from icecube import icetray, dataclasses
+from ShowerStore import load_showers, save_showers, save_columns, replace_store
+from Cutflow import Cutflow
+from TankIntersect import TankGrid, count_hits, TANK_RADIUS, TANK_HEIGHT
+from CorsikaMuons import load_muons, muon_file_info, MUON_X, MUON_Y, MUON_DIR
+from GeometryCache import load_geometry_table
+from FileManifest import make_dirs
 
 
 
 
 # ------------------------------------------------------------------------------
-# Intersect function -----------------------------------------------------------
+# Tanks and muons --------------------------------------------------------------
 # ------------------------------------------------------------------------------
 
-def intersect(x,y,z,nx,ny,nz,tank):
-    
-    # code to see if the particle intersects a detector
-    # if it does, function returns True, else it returns False
-    
-    # tank coordinates
-    xtank = tank[2]
-    ytank = tank[3]
-    ztank = tank[4]
-    
-    # tank dimensions
-    radius  = 1.82/2.0+0.01 # meters
-    height  = 0.90+0.02 # meters
-    zTop    = 0.5*height
-    zBottom = -0.5*height
-    
-    # Relative coordinates with respect to tank
-    rx = x - xtank
-    ry = y - ytank
-    rz = z - ztank
-    
-    if nx**2 + ny**2 > 0:
-        
-        # Inclined Track
-        
-        # calculate the square-root argument
-        arg = (nx**2 + ny**2)*radius**2 - (nx*ry - ny*rx)**2
-        
-        # if arg <= 0 the tank won't be hit
-        if arg <= 0:
-            return False
-
-        # times of cylinder intersections (t1 < t2)
-        t1 = (-(rx*nx + ry*ny) - np.sqrt(arg))/(nx**2 + ny**2)
-        t2 = (-(rx*nx + ry*ny) + np.sqrt(arg))/(nx**2 + ny**2)
-        
-        # z-coordinates of cylinder intersections
-        z1 = rz + nz*t1
-        z2 = rz + nz*t2
-        
-        # If the intersections are both above or both below the tank, then the 
-        # tank won't be hit. Otherwise, the tank is hit
-        if z1 > zTop and z2 > zTop:
-            return False
-        elif z1 < zBottom and z2 < zBottom:
-            return False
-        else:
-            return True
+# the CORSIKA file of a run
+def corsika_file_name(run):
+    run = str(run)
+    return corsika_location + "Muons" + "000000"[:-len(run)] + run
+
+
+
+# This function reads the muons of a CORSIKA file (parsed once, and then
+# loaded from the cache, see "CorsikaMuons.py"). 'info' is the
+# muon_file_info() of the file if it is already known.
+# returns an (n_muons x 5) array of x, y (relative to the core), nx, ny, nz
+def read_muons(corsika_file,info=None):
+    muons = load_muons(corsika_file,info=info)
+    return np.asarray(muons[:,[MUON_X,MUON_Y]+MUON_DIR],dtype=float)
+
+# This function parses a CORSIKA file into the cache, if it is not there yet
+def cache_muons(args):
+    corsika_file, info = args
+    load_muons(corsika_file,info=info)
+
+
+
+# This function counts the muons that hit each tank when the shower core is
+# at (xc,yc,zc). The muons all start at the height of the core.
+# 'grid' is the TankGrid of the tank positions
+# returns the number of muons per tank, and the summed track length per tank
+def count_muons(muons,xc,yc,zc,grid):
+    pos = np.column_stack([muons[:,0] + xc,
+                           muons[:,1] + yc,
+                           np.zeros(len(muons)) + zc])
+    hit, length = grid.intersect(pos,muons[:,2:5],lengths=True)
+    ntanks = len(grid.tank_pos)
+    return count_hits(hit,ntanks), count_hits(hit,ntanks,weights=length)
+
+
+
+# This function gives n random cores (x,y), uniform in a disk of 'radius'
+# around the center of IceTop
+def random_cores(n,radius,rng):
+    r   = radius*np.sqrt(rng.uniform(size=n))
+    phi = 2*np.pi*rng.uniform(size=n)
+    return np.column_stack([r*np.cos(phi),r*np.sin(phi)])
+
+
+
+# This function is count_muons() for many cores (x,y) at the height zc, the
+# muons of several throws are tested together.
+# returns the number of muons per tank of every throw (n_cores x n_tanks)
+def count_muons_resampled(muons,cores,zc,grid,chunk=2**20):
+
+    ntanks = len(grid.tank_pos)
+    counts = np.zeros((len(cores),ntanks),dtype=np.int32)
+    if len(muons) == 0:
+        return counts
+
+    # how many throws are done at once, so there are about 'chunk' muons
+    nthrows = max(1,chunk//len(muons))
+    for start in range(0,len(cores),nthrows):
+        c = cores[start:start+nthrows]
+
+        # the muons of all the throws, one throw after the other
+        pos = np.column_stack([(muons[None,:,0] + c[:,0,None]).ravel(),
+                               (muons[None,:,1] + c[:,1,None]).ravel(),
+                               np.zeros(len(c)*len(muons)) + zc])
+        dirs = np.tile(muons[:,2:5],(len(c),1))
+        hit  = grid.intersect(pos,dirs)
+
+        # count the hits per throw and tank
+        throw = np.repeat(np.arange(len(c)),len(muons))
+        index = throw[hit >= 0]*ntanks + hit[hit >= 0]
+        counts[start:start+len(c)] = np.bincount(index,
+                                minlength=len(c)*ntanks).reshape(len(c),ntanks)
+
+    return counts
 
-    else:
-        
-        # Vertical track
-        
-        if np.sqrt(rx**2 + ry**2) >= radius:
-            return False
-        else:
-            return True
-            
 
 
 
 # ------------------------------------------------------------------------------
-# MAIN -------------------------------------------------------------------------
+# Process one shower -----------------------------------------------------------
 # ------------------------------------------------------------------------------
 
-#load the showers
-data_location = './data/'
-protondata = np.load(data_location + 'proton_showers.npy')
-#irondata = np.load(data_location + 'iron_showers.npy')
+# the tank grid, the settings of the resampling (number of throws, radius
+# of the disk and random seed), whether to use the cache, and the fingerprint
+# of the geometry, set by setup() in every process
+grid        = None
+resample    = (0,400.,0)
+use_cache   = True
+fingerprint = None
+
+# this is also the initializer of the worker processes
+def setup(tank_pos,throws=0,radius=400.,seed=0,cache=True):
+    global grid, resample, use_cache, fingerprint
+    grid        = TankGrid(tank_pos)
+    resample    = (throws,radius,seed)
+    use_cache   = cache
+    fingerprint = geometry_fingerprint(tank_pos)
+
+
+
+# ------------------------------------------------------------------------------
+# Cache of the results ---------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# the fingerprint of the tank positions and dimensions
+def geometry_fingerprint(tank_pos):
+    h = hashlib.sha1(np.asarray(tank_pos,dtype=np.float64).tobytes())
+    h.update(np.array([TANK_RADIUS,TANK_HEIGHT],dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+# where the result of a shower is cached, one small .npy file per shower in a
+# folder per CORSIKA file, named by the hash of the key: the content hash of
+# the CORSIKA file, the core and the fingerprint of the geometry
+def cache_path(corsika_file,corsika_hash,xc,yc,zc,geometry):
+    h = hashlib.sha1(corsika_hash.encode())
+    h.update(np.array([xc,yc,zc],dtype=np.float64).tobytes())
+    h.update(geometry.encode())
+    return os.path.join(intersect_cache_location,os.path.basename(corsika_file),
+                                                        h.hexdigest()+".npy")
+
+# the cached rows are the muon numbers and the track lengths
+def load_cached(path):
+    result = np.load(path)
+    return result[0].astype(int), result[1]
+
+# (the workers that finish showers of the same run make the folder at once)
+def save_cached(path,nMuons,TrackLength):
+    make_dirs(os.path.dirname(path))
+    tmp_path = path[:-4]+".tmp%d.npy" % os.getpid()
+    np.save(tmp_path,np.array([nMuons,TrackLength],dtype=np.float64))
+    os.rename(tmp_path,path)
+
+
+
+# returns the number of muons and the track length per tank of a shower, and
+# the cutflow (as a dictionary, see "Cutflow.py")
+# 'info' is the muon_file_info() of the CORSIKA file (found once per file in
+# main()), its hash is part of the key of the cache
+def process_shower(args):
+
+    shower_number, nshowers, run, xc, yc, zc, info = args
+
+    print "Starting shower",shower_number+1,"of",str(nshowers)
+
+    cutflow = Cutflow(['showers','cached','muons','hits'])
+    cutflow.count('showers')
+
+    corsika_file = corsika_file_name(run)
+
+    # the result of an earlier run
+    if use_cache:
+        with cutflow.timer('cache'):
+            if info is None:
+                info = muon_file_info(corsika_file)
+            path = cache_path(corsika_file,info['hash'],xc,yc,zc,fingerprint)
+            if os.path.isfile(path):
+                nMuons, TrackLength = load_cached(path)
+                cutflow.count('cached')
+                cutflow.count('hits',int(nMuons.sum()))
+                return nMuons, TrackLength, cutflow.to_dict()
+
+    # read the muons of the file
+    with cutflow.timer('read'):
+        muons = read_muons(corsika_file,info)
+
+    # the muon number per tank
+    with cutflow.timer('intersect'):
+        nMuons, TrackLength = count_muons(muons,xc,yc,zc,grid)
+
+    if use_cache:
+        with cutflow.timer('cache'):
+            save_cached(path,nMuons,TrackLength)
+
+    cutflow.count('muons',len(muons))
+    cutflow.count('hits',int(nMuons.sum()))
+
+    return nMuons, TrackLength, cutflow.to_dict()
+
 
 
+# returns the random cores and the number of muons per tank of every throw of
+# a shower, and the cutflow (as a dictionary, see "Cutflow.py")
+# The cores of a shower only depend on the seed and the number of the shower,
+# so they are the same with any number of jobs.
+def resample_shower(args):
+
+    shower_number, nshowers, run, xc, yc, zc, info = args
+    throws, radius, seed = resample
+
+    print "Resampling shower",shower_number+1,"of",str(nshowers)
+
+    cutflow = Cutflow(['showers','throws','muons','hits'])
+
+    # read the muons of the file, once for all the throws
+    with cutflow.timer('read'):
+        muons = read_muons(corsika_file_name(run),info)
+
+    rng   = np.random.RandomState([seed,shower_number])
+    cores = random_cores(throws,radius,rng)
+    with cutflow.timer('intersect'):
+        counts = count_muons_resampled(muons,cores,zc,grid)
+
+    cutflow.count('showers')
+    cutflow.count('throws',throws)
+    cutflow.count('muons',len(muons)*throws)
+    cutflow.count('hits',int(counts.sum()))
+
+    return cores, counts, cutflow.to_dict()
+
+
+
+
+# ------------------------------------------------------------------------------
+# MAIN -------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# GCD file of the tank positions
+geom_location = "./data/GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz"
 #corsika file location
 corsika_location = '/cr/data01/hagne/John_project/CORSIKA/muonsPROPER/'
+# where to find and save the showers
+data_location = './data/'
+save_location = './data/'
+# where the muon numbers of --resample are saved
+resample_location = './data/resampled'
+# where the results of the showers are cached
+intersect_cache_location = './data/intersect_cache/'
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Count the CORSIKA muons "+
+                                        "that hit each tank")
+    parser.add_argument('--jobs',type=int,default=1,
+                        help="number of showers processed in parallel")
+    parser.add_argument('--resample',type=int,default=0,metavar='N',
+                        help="throw the muons of every shower at N random "+
+                             "cores, and save the muon numbers of every throw "+
+                             "in "+resample_location)
+    parser.add_argument('--radius',type=float,default=400.,
+                        help="radius of the disk of the random cores in "+
+                             "meters (default: 400)")
+    parser.add_argument('--seed',type=int,default=0,
+                        help="random seed of the cores (default: 0)")
+    parser.add_argument('--no-cache',action='store_true',
+                        help="compute every shower again, instead of taking "+
+                             "the results in "+intersect_cache_location)
+    args = parser.parse_args()
+
+    #load the showers
+    protondata = load_showers(data_location + 'proton_showers')
+    #irondata = load_showers(data_location + 'iron_showers')
+
+    # get geometry info, the centers of the tanks in tank index order (see
+    # TANK_INDEX in "ShowerClass.py")
+    tank_pos = load_geometry_table(geom_location)['TankCenter']
+
+    # ------------------------------------------------------------------
+    # We only have a limited number of CORSIKA files right now
+    # AND some of those we've alread done. So we'll use a list of run numbers to
+    # determine which showers we want to do.
+    # (the showers of those runs are found with the index of the store, and
+    # only they are read)
+    corsika_list = np.load("corsika_list.npy")
+    data = [protondata[i] for i in protondata.select_runs(corsika_list)]
+    del protondata # don't keep the whole list because it takes up memory
 
+    save_list = [] # this is the list of showers to save in a new file
+    # ------------------------------------------------------------------
 
-# get geometry info
-geom_file  = I3File("./data/GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz")
-geom_frame = geom_file.pop_frame()
-geometry   = geom_frame['I3Geometry']
-geom_file.close()
-
-# list of tanks
-tanks = []
-for i in range(1,82):
-    # arrays are [station #, tank #, number of muons detected]
-    # tank 1 contains DOMs 61,62; tank 2 contains DOMs 63,64
-    tanks.append([i,1])
-    tanks.append([i,2])
-# tank coordinates -------------------
-for tank in tanks:
-    station = tank[0]
-    if tank[1] == 1:
-        om = 61
+    cutflow = Cutflow(['showers','muons','hits'])
+    start   = time.time()
+
+    process   = resample_shower if args.resample > 0 else process_shower
+    initargs  = (tank_pos,args.resample,args.radius,args.seed,not args.no_cache)
+    use_cache = args.resample == 0 and not args.no_cache
+    if args.jobs > 1:
+        pool = Pool(args.jobs,initializer=setup,initargs=initargs)
+        run_all = lambda f, items: pool.map(f,items,chunksize=1)
     else:
-        om = 63
-    # take average x,y of the two DOMs in the tank
-    # DOM 1 (61/63)
-    key1 = icetray.OMKey(station,om)
-    xt1  = geometry.omgeo[key1].position.x 
-    yt1  = geometry.omgeo[key1].position.y
-    # DOM 2 (62/64)
-    key2 = icetray.OMKey(station,om+1)
-    xt2  = geometry.omgeo[key2].position.x 
-    yt2  = geometry.omgeo[key2].position.y
-    # tank position 
-    xt = (xt1+xt2)/2.0
-    yt = (yt1+yt2)/2.0
-    # subtract 0.2 from z because center of ice is below center of tank
-    zt = geometry.omgeo[key1].position.z - 0.2
-    
-    
-    # append tank position, and a zero, which will later hold muon numbers
-    tank.extend([xt,yt,zt,0])
-
-   
-# ------------------------------------------------------------------
-# We only have a limited number of CORSIKA files right now
-# AND some of those we've alread done. So we'll use a list of run numbers to
-# determine which showers we want to do.
-corsika_list = np.load("corsika_list.npy")
-data = []
-for shower in protondata:
-    if shower.Run in corsika_list:
-        data.append(shower)
-del protondata # don't keep the whole list because it takes up memory
-
-save_list = [] # this is the list of showers to save in a new file
-# ------------------------------------------------------------------
-
-for i in range(len(data)):
-
-    print "Starting shower",i+1,"of",str(len(data))
-    
-    shower = data[i]
-    
-    run = str(shower.Run)
-    file_name = "Muons" + "000000"[:-len(run)] + run
-    corsika_file = corsika_location + file_name
-    
-    # shower core
-    xc = shower.Primary.x
-    yc = shower.Primary.y
-    zc = shower.Primary.z
-    
-    # resent the muon number per tank
-    for tank in tanks:
-        tank[5] = 0
-
-    intmuon = 0 # number of intersecting muons
-    # go through file line by line
-    with open(corsika_file) as infile:
-        for line in infile:
-            line = line.split()
-            
-            # the particles
-            if len(line) > 0 and line[0] == 'Muon:':
-                x = float(line[1]) + xc
-                y = float(line[2]) + yc
-                z = zc
-
-                nx = float(line[4])
-                ny = float(line[5])
-                nz = float(line[6])
-
-                for tank in tanks:
-                    flag = intersect(x,y,z,nx,ny,nz,tank)
-                    if flag == True:
-                        intmuon += 1
-                        tank[5] += 1
-                        break
-    
-    # add the new data to the shower object
-    shower.TotalMuons = intmuon
-    for i in range(len(tanks)):
-        shower.Signals.nMuons.append(tanks[i][5])
-    
-    save_list.append(shower)
-    
-    for i in range(len(tanks)):
-        if shower.Signals.MuonPE[i] > 0 and shower.Signals.nMuons[i] == 0:
-            print "WARNING! Error in Run",shower.Run,"Event",shower.Event
-
-# save the data
-save_location = './data/'
-np.save(save_location+'proton_showers_new_save.npy',save_list)
+        setup(*initargs)
+        run_all = map
+
+    # the size, mtime and hash of the CORSIKA file of every run, found once
+    # per file (by the workers), for the keys of the cache
+    corsika_files = sorted(set(corsika_file_name(s.Run) for s in data))
+    infos = dict()
+    if use_cache:
+        infos = dict(zip(corsika_files,run_all(muon_file_info,corsika_files)))
+
+    # the run, the shower core and the CORSIKA file info of every shower
+    nshowers = len(data)
+    tasks    = [(i,nshowers,data[i].Run,data[i].Primary.x,data[i].Primary.y,
+                 data[i].Primary.z,infos.get(corsika_file_name(data[i].Run)))
+                                                        for i in range(nshowers)]
+
+    # the showers of a run are next to each other, so the CORSIKA file of
+    # every run with showers that are not in the cache is parsed once (one
+    # file per worker) before the showers are spread over the workers,
+    # instead of by several workers at once
+    if args.jobs > 1:
+        geometry = geometry_fingerprint(tank_pos)
+        parse    = dict()
+        for task in tasks:
+            corsika_file = corsika_file_name(task[2])
+            if not use_cache or not os.path.isfile(cache_path(corsika_file,
+                                task[6]['hash'],task[3],task[4],task[5],geometry)):
+                parse[corsika_file] = task[6]
+        run_all(cache_muons,sorted(parse.items()))
+
+    # loop through the showers, the results come back in shower order
+    if args.jobs > 1:
+        results = iter(pool.imap(process,tasks,chunksize=1))
+    else:
+        results = (process(task) for task in tasks)
+
+    if args.resample > 0:
+        save_resampled(data,results,args.resample,len(tank_pos),cutflow)
+        data = [] # the showers are not changed
+
+    for shower in data:
+
+        nMuons, TrackLength, shower_cutflow = next(results)
+        cutflow.merge(shower_cutflow)
+        intmuon = int(nMuons.sum()) # number of intersecting muons
+
+        # add the new data to the shower object
+        shower.TotalMuons = intmuon
+        shower.Signals.nMuons = nMuons.tolist()
+        shower.Signals.TrackLength = TrackLength.tolist()
+
+        save_list.append(shower)
+
+        for i in range(len(tank_pos)):
+            if shower.Signals.MuonPE[i] > 0 and shower.Signals.nMuons[i] == 0:
+                print "WARNING! Error in Run",shower.Run,"Event",shower.Event
+
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+
+    # save the data
+    if args.resample == 0:
+        with cutflow.timer('save'):
+            save_showers(save_location+'proton_showers_new_save',save_list)
+
+    cutflow.add_time('run',time.time() - start)
+    cutflow.save(save_location+'cutflow_intersect.json')
+    print "-------------------------"
+    print cutflow.summary()
+
+
+# This function saves the results of resample_shower() (in shower order) in
+# resample_location, in the columnar format of "ShowerStore.py":
+#   Run.npy, Event.npy -> (n_showers) the showers
+#   Cores.npy          -> (n_showers x N x 2) the cores (x,y) of the throws
+#   nMuons.npy         -> (n_showers x N x 162) muon numbers of the throws
+# The muon numbers are written shower by shower, so memory stays flat.
+def save_resampled(data,results,throws,ntanks,cutflow):
+
+    tmp_path = resample_location+".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    save_columns(tmp_path,{'Run':   np.array([s.Run for s in data],dtype=np.int64),
+                           'Event': np.array([s.Event for s in data],dtype=np.int64)})
+
+    n = len(data)
+    if n == 0:
+        np.save(os.path.join(tmp_path,"Cores.npy"),np.zeros((0,throws,2)))
+        np.save(os.path.join(tmp_path,"nMuons.npy"),
+                                np.zeros((0,throws,ntanks),dtype=np.int32))
+        replace_store(tmp_path,resample_location)
+        return
+    cores  = np.lib.format.open_memmap(os.path.join(tmp_path,"Cores.npy"),
+                            mode='w+',dtype=np.float64,shape=(n,throws,2))
+    counts = np.lib.format.open_memmap(os.path.join(tmp_path,"nMuons.npy"),
+                            mode='w+',dtype=np.int32,shape=(n,throws,ntanks))
+    for i in range(n):
+        cores[i], counts[i], shower_cutflow = next(results)
+        cutflow.merge(shower_cutflow)
+    cores.flush()
+    counts.flush()
+    del cores, counts
+
+    with cutflow.timer('save'):
+        replace_store(tmp_path,resample_location)
+
 
 
+if __name__ == '__main__':
+    main()
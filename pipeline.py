@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# This script does the work of "quality_cuts.py" and "Showers.py" in a single
+# pass over the raw Level2 files: every IceTop frame is checked with the
+# quality cuts, and the showers of the frames that pass are extracted right
+# away. There are no intermediate I3 files to write and decode again.
+# The showers are saved in the data folder, just like Showers.py does.
+#
+# Writing the filtered I3 files (like quality_cuts.py) is optional, e.g.
+#   ./pipeline.py --jobs 16 --write-i3
+# The cutflow of every file and of the run (frames that pass each cut, and the
+# time spent in each stage) is saved as json next to the shards.
+
+# ------------------------------------------------------------------------------
+# make sure IceTray environment is active
+import os
+if not 'I3_BUILD' in os.environ:
+    raise Exception('To run this script start an IceTray environment \n' + \
+                     'This can be achieved via ./env-shell.sh')
+# ------------------------------------------------------------------------------
+
+
+import glob
+import time
+import argparse
+
+import Showers
+from Showers import extract_shower, extract_files, setup, shard_tag
+from quality_cuts import first_failed_cut, CUTS, data_location, cut_location, \
+                        FilteredWriter
+from Cutflow import Cutflow
+from ShowerClass import TIME_POLICIES
+from ShowerStore import showers_to_columns
+from GeometryCache import load_geometry_table
+from FileManifest import file_info
+
+from icecube.dataio import I3File
+from icecube import icetray
+
+# where the showers of each file are saved while the script runs
+# (not the same as for Showers.py, which works on the filtered files)
+shard_location = './data/shards_pipeline/'
+
+# whether the frames that pass are also written to I3 files, set by setup_pipeline()
+write_i3 = False
+
+
+
+# set the options and load the geometry, this is also the initializer of the
+# worker processes
+def setup_pipeline(policy,write):
+    global write_i3
+    write_i3 = write
+    setup(policy)
+
+
+
+# ------------------------------------------------------------------------------
+# Process one file -------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# the counts of the cutflow: the IceTop frames seen, the frames that pass each
+# cut, and the showers extracted
+CUTFLOW_COUNTS = ['seen'] + [name for name, cut in CUTS] + ['showers']
+
+# returns the showers of the frames that pass the cuts, as columns, the
+# cutflow of the file (as a dictionary, see "Cutflow.py") and the file_info()
+# of the file for the manifest of the shards
+def process_file(args):
+
+    file_number, nfiles, file_name = args
+
+    print "Starting",file_name,"(file",file_number+1,"of "+str(nfiles)+")"
+
+    cutflow = Cutflow(CUTFLOW_COUNTS)
+    start   = time.time()
+    info    = file_info(file_name)
+
+    i3f = I3File(file_name)
+
+    # the frames are written to a temporary file first, which only gets its
+    # final name when it is closed (see FilteredWriter in "quality_cuts.py")
+    cut_file = None
+    if write_i3:
+        cut_file = FilteredWriter(cut_location + os.path.basename(file_name))
+
+    showers = []
+    while i3f.more():
+        with cutflow.timer('read'):
+            frame = i3f.pop_frame()
+        if frame.Stop != icetray.I3Frame.Physics:
+            # the frames the physics frames rely on
+            if cut_file is not None:
+                cut_file.parent(frame)
+            continue
+        header = frame["I3EventHeader"]
+        if header.sub_event_stream != "ice_top":
+            continue
+        cutflow.count('seen')
+        if first_failed_cut(frame,Showers.dom_pos,cutflow) == len(CUTS):
+
+            with cutflow.timer('extract'):
+                showers.append(extract_shower(frame))
+            cutflow.count('showers')
+
+            if cut_file is not None:
+                # written with the frames it relies on that are not in the
+                # file yet
+                with cutflow.timer('write'):
+                    cut_file.push(frame)
+
+    i3f.close()
+
+    # the cut file gets its final name, or is removed if no frame passed
+    if cut_file is not None:
+        with cutflow.timer('write'):
+            cut_file.close()
+
+    columns = showers_to_columns(showers)
+    cutflow.add_time('total',time.time() - start)
+    return columns, cutflow.to_dict(), info
+
+
+
+# ------------------------------------------------------------------------------
+# MAIN -------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Apply the quality cuts and "+
+                        "extract the IceTop showers from the I3 files in "+
+                        data_location)
+    parser.add_argument('--jobs',type=int,default=1,
+                        help="number of files processed in parallel")
+    parser.add_argument('--fresh',action='store_true',
+                        help="ignore the shards of a previous run")
+    parser.add_argument('--time-policy',default='last',choices=TIME_POLICIES,
+                        help="which pulse gives the time delay of a tank "+
+                             "with several pulses (default: last)")
+    parser.add_argument('--write-i3',action='store_true',
+                        help="also write the frames that pass to "+cut_location)
+    args = parser.parse_args()
+
+    # list of appropriate files in folder
+    files = sorted(glob.glob(data_location + 'Level2*'))
+
+    # compile the geometry table once, before the workers load it
+    load_geometry_table(Showers.geom_location)
+
+    # a shard is only up to date if it was made with the same time policy
+    # and --write-i3 (a shard made without it has no I3 file)
+    tags = dict((f,shard_tag(time_policy=args.time_policy,
+                             write_i3=args.write_i3)) for f in files)
+
+    extract_files(files,process_file,setup_pipeline,
+                  (args.time_policy,args.write_i3),
+                  shard_location,jobs=args.jobs,fresh=args.fresh,tags=tags)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@
 
 import numpy as np
 from ShowerClass import *
+from ShowerStore import load_showers
+from Selection import Selection
 import matplotlib.pyplot as plt
 from matplotlib import pylab
 
@@ -24,48 +26,33 @@ data_location = './data/'
 
 #load the data
 if element == 1:
-    Data = np.load(data_location+"proton_showers.npy")
+    Data = load_showers(data_location+"proton_showers")
 elif element == 2:
-    Data = np.load(data_location+"iron_showers.npy")
+    Data = load_showers(data_location+"iron_showers")
 else:
     print "Please set 'element' to either 1 (proton) or 2 (iron)"
     exit()
 
 
-muontot  = [] # total muon signal
-muonHLC  = [] # muon HLCs
-muonSLC  = [] # muon SLCs
-othertot = [] # total signal from other particles
-otherHLC = [] # HLCs from other particles
-otherSLC = [] # SLCs from other particles
-HLC      = [] # all HLCs
-SLC      = [] # all SLCs
-
-for shower in Data:
-    if shower.Primary.Energy > E_lowerlimit and \
-    shower.Primary.Energy < E_upperlimit:
-        for i in range(len(shower.Signals.Tank)): # loop through every tank
-
-            # only tanks far enough from the core AND containing some charge
-            if shower.Signals.LatDist[i] > distance and \
-            shower.Signals.TotalPE[i] > 0:
-
-                # scale the PE by (total VEM)/(total PE)
-                scale = shower.Signals.TotalVEM[i]/shower.Signals.TotalPE[i]
-                muon_signal  = scale*shower.Signals.MuonPE[i]
-                muontot.append(muon_signal)
-                other_signal = scale*shower.Signals.OtherPE[i]
-                othertot.append(other_signal)
-
-                if shower.Signals.HLCVEM[i] > 0: # check if this is an HLC
-                    HLC.append(shower.Signals.HLCVEM[i])
-                    muonHLC.append(muon_signal)
-                    otherHLC.append(other_signal)
-
-                elif shower.Signals.SLCVEM[i] > 0: # check if this is an SLC
-                    SLC.append(shower.Signals.SLCVEM[i])
-                    muonSLC.append(muon_signal)
-                    otherSLC.append(other_signal)
+sel = Selection(Data)
+
+# only tanks far enough from the core AND containing some charge, in showers
+# in the energy range
+events = sel.events(("Primary.Energy",">",E_lowerlimit),
+                    ("Primary.Energy","<",E_upperlimit))
+tanks  = sel.tanks(("LatDist",">",distance),"TotalPE > 0",events=events)
+hlc    = tanks & sel.cut("HLCVEM > 0")          # the HLCs
+slc    = tanks & ~hlc & sel.cut("SLCVEM > 0")   # the SLCs
+
+# the PE scaled by (total VEM)/(total PE)
+muontot  = sel.values("MuonVEM",tanks)  # total muon signal
+muonHLC  = sel.values("MuonVEM",hlc)    # muon HLCs
+muonSLC  = sel.values("MuonVEM",slc)    # muon SLCs
+othertot = sel.values("OtherVEM",tanks) # total signal from other particles
+otherHLC = sel.values("OtherVEM",hlc)   # HLCs from other particles
+otherSLC = sel.values("OtherVEM",slc)   # SLCs from other particles
+HLC      = sel.values("HLCVEM",hlc)     # all HLCs
+SLC      = sel.values("SLCVEM",slc)     # all SLCs
 
 
 # Take log of all the data
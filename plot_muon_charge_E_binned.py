@@ -7,6 +7,8 @@
 
 import numpy as np
 from ShowerClass import *
+from ShowerStore import load_showers
+from Selection import Selection
 import matplotlib.pyplot as plt
 from matplotlib import pylab
 import seaborn as sns
@@ -34,10 +36,10 @@ data_location = './data/'
 
 #load the data
 if element == 1:
-    Data = np.load(data_location+"proton_showers.npy")
+    Data = load_showers(data_location+"proton_showers")
     primary = "Proton"
 elif element == 2:
-    Data = np.load(data_location+"iron_showers.npy")
+    Data = load_showers(data_location+"iron_showers")
     primary = "Iron"
 else:
     print "Please set 'element' to either 1 (proton) or 2 (iron)"
@@ -45,44 +47,27 @@ else:
 
 
 # Collect data from all the showers
-for shower in Data:
-     # step through the energy ranges to find which one the shower belongs to
-    for j in range(len(E)-1):
-        if np.log10(shower.Primary.Energy) >= E[j] and \
-        np.log10(shower.Primary.Energy) < E[j+1]:
-            
-            muonPE_  = 0
-            Tot_     = 0
-            HLC_     = 0
-            SLC_     = 0
-            
-            for i in range(len(shower.Signals.Tank)): # loop through every tank
-                if shower.Signals.LatDist[i] >= distance and \
-                shower.Signals.TotalPE[i] > 0:
-                    
-                    # convert PEs to VEM
-                    totalVEM = shower.Signals.TotalVEM[i]
-                    totalPE  = shower.Signals.TotalPE[i]
-                    scale = totalVEM/totalPE
-                    scaledPE = scale*shower.Signals.MuonPE[i]
-                    
-                    # sum signals that are within cuts
-                    if scaledPE >= q_lowerlimit and scaledPE <= q_upperlimit:
-                        muonPE_ += scaledPE
-                    if totalVEM >= q_lowerlimit and totalVEM <= q_upperlimit:
-                        Tot_ += totalVEM
-                    if shower.Signals.HLCVEM[i] >= q_lowerlimit and \
-                    shower.Signals.HLCVEM[i] <= q_upperlimit:
-                        HLC_ += shower.Signals.HLCVEM[i]
-                    if shower.Signals.SLCVEM[i] >= q_lowerlimit and \
-                    shower.Signals.SLCVEM[i] <= q_upperlimit:
-                        SLC_ += shower.Signals.SLCVEM[i]
-
-            # add the summed signals to the array for the corr. energy range
-            E_dict[j][0].append(muonPE_)
-            E_dict[j][1].append(Tot_)
-            E_dict[j][2].append(HLC_)
-            E_dict[j][3].append(SLC_)
+# the tanks far enough from the core that have some charge
+sel   = Selection(Data)
+tanks = sel.tanks(("LatDist",">=",distance),"TotalPE > 0")
+
+# sum the signals that are within the charge cuts, for every shower
+def window_sum(name):
+    window = tanks & sel.window(name,q_lowerlimit,q_upperlimit)
+    return sel.tank_sum(name,window)
+
+muonPE_ = window_sum("MuonVEM") # the muon PEs converted to VEM
+Tot_    = window_sum("TotalVEM")
+HLC_    = window_sum("HLCVEM")
+SLC_    = window_sum("SLCVEM")
+
+# add the summed signals to the array for the corr. energy range
+for j in range(len(E)-1):
+    in_range = sel.events(("logE",">=",E[j]),("logE","<",E[j+1]))
+    E_dict[j][0] = muonPE_[in_range].tolist()
+    E_dict[j][1] = Tot_[in_range].tolist()
+    E_dict[j][2] = HLC_[in_range].tolist()
+    E_dict[j][3] = SLC_[in_range].tolist()
 
 
 
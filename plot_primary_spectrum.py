@@ -7,24 +7,21 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.pylab as pylab
 
+from ShowerStore import load_showers
+from Selection import Selection
+
 
 data_location = './data/'
 
 #load the data
-protondata = np.load(data_location+"proton_showers.npy")
-irondata   = np.load(data_location+"iron_showers.npy")
-
-proton_energy = []
-iron_energy   = []
+protondata = load_showers(data_location+"proton_showers")
+irondata   = load_showers(data_location+"iron_showers")
 
-for shower in protondata:
-    proton_energy.append(shower.Primary.Energy)
-for shower in irondata:
-    iron_energy.append(shower.Primary.Energy)
-    
+proton_energy = Selection(protondata).field("Primary.Energy")
+iron_energy   = Selection(irondata).field("Primary.Energy")
 
-log_p_en  = [np.log10(i) for i in proton_energy]
-log_fe_en = [np.log10(i) for i in iron_energy]
+log_p_en  = np.log10(proton_energy)
+log_fe_en = np.log10(iron_energy)
 data = [log_p_en,log_fe_en]
 
 
@@ -8,6 +8,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.pylab as pylab
 
+from ShowerStore import load_showers
+from Selection import Selection
+
 
 element  = 2   # set 1 for protons, 2 for iron
 
@@ -16,9 +19,9 @@ data_location = './data/'
 
 #load the data
 if element == 1:
-    Data = np.load(data_location+"proton_showers.npy")
+    Data = load_showers(data_location+"proton_showers")
 elif element == 2:
-    Data = np.load(data_location+"iron_showers.npy")
+    Data = load_showers(data_location+"iron_showers")
 else:
     print "Please set 'element' to either 1 (proton) or 2 (iron)"
     exit()
@@ -29,18 +32,13 @@ figure_location = "./figures/"
 
 
 # Collect the data
-HLC_latdist = []
-HLC_charge  = []
-SLC_latdist = []
-SLC_charge  = []
-for shower in Data:
-    for i in range(len(shower.Signals.Tank)):
-        if shower.Signals.HLCVEM[i] > 0:
-            HLC_latdist.append(shower.Signals.LatDist[i])
-            HLC_charge.append(shower.Signals.HLCVEM[i])
-        elif shower.Signals.SLCVEM[i] > 0:
-            SLC_latdist.append(shower.Signals.LatDist[i])
-            SLC_charge.append(shower.Signals.SLCVEM[i])
+sel = Selection(Data)
+hlc = sel.tanks("HLCVEM > 0")
+slc = ~hlc & sel.tanks("SLCVEM > 0")
+HLC_latdist = sel.values("LatDist",hlc)
+HLC_charge  = sel.values("HLCVEM",hlc)
+SLC_latdist = sel.values("LatDist",slc)
+SLC_charge  = sel.values("SLCVEM",slc)
 
 
 
@@ -6,6 +6,8 @@
 
 import numpy as np
 from ShowerClass import *
+from ShowerStore import load_showers
+from Selection import Selection
 import matplotlib.pyplot as plt
 from matplotlib import pylab
 import seaborn as sns
@@ -27,49 +29,31 @@ data_location = './data/'
 
 #load the data
 if element == 1:
-    Data = np.load(data_location+"proton_showers.npy")
+    Data = load_showers(data_location+"proton_showers")
 elif element == 2:
-    Data = np.load(data_location+"iron_showers.npy")
+    Data = load_showers(data_location+"iron_showers")
 else:
     print "Please set 'element' to either 1 (proton) or 2 (iron)"
     exit()
 
 
-PE300  = []
-SLC300 = []
-HLC300 = []
-VEM300 = []
-
-
-for shower in Data:
-    if shower.Primary.Energy > E_lowerlimit and \
-    shower.Primary.Energy < E_upperlimit:
-        PE300_ = 0
-        SLC300_ = 0
-        HLC300_ = 0
-        VEM300_ = 0
-        for i in range(len(shower.Signals.Tank)):
-            if shower.Signals.LatDist[i] >= distance and \
-            shower.Signals.TotalPE[i] > 0:
-                totalVEM = shower.Signals.TotalVEM[i]
-                totalPE  = shower.Signals.TotalPE[i]
-                scale = totalVEM/totalPE
-                scaledPE = scale*shower.Signals.MuonPE[i]
-                if scaledPE > q_lowerlimit and scaledPE < q_upperlimit:
-                    PE300_ += scaledPE
-                if (shower.Signals.HLCVEM[i] > q_lowerlimit and 
-                shower.Signals.HLCVEM[i] < q_upperlimit):
-                    HLC300_ += shower.Signals.HLCVEM[i]
-                if (shower.Signals.SLCVEM[i] > q_lowerlimit and 
-                shower.Signals.SLCVEM[i] < q_upperlimit):
-                    SLC300_ += shower.Signals.SLCVEM[i]
-                if totalVEM > q_lowerlimit and totalVEM < q_upperlimit:
-                    VEM300_ += shower.Signals.TotalVEM[i]
-
-        PE300.append(PE300_)
-        SLC300.append(SLC300_)
-        HLC300.append(HLC300_)
-        VEM300.append(VEM300_)
+sel = Selection(Data)
+
+# showers in the energy range, and their tanks far enough from the core that
+# have some charge
+events = sel.events(("Primary.Energy",">",E_lowerlimit),
+                    ("Primary.Energy","<",E_upperlimit))
+tanks  = sel.tanks(("LatDist",">=",distance),"TotalPE > 0")
+
+# sum the signals that are within the charge cuts (not including the limits)
+def window_sum(name):
+    window = tanks & sel.window(name,q_lowerlimit,q_upperlimit,closed=False)
+    return sel.tank_sum(name,window)[events].tolist()
+
+PE300  = window_sum("MuonVEM")
+SLC300 = window_sum("SLCVEM")
+HLC300 = window_sum("HLCVEM")
+VEM300 = window_sum("TotalVEM")
 
 
 
@@ -1,9 +1,29 @@
 #!/usr/bin/env python
 
+# This script applies the quality cuts to the Level2 simulation files, and
+# saves the frames that pass (with the frames they rely on) in ./data/i3files
+# The cuts themselves are applied by first_failed_cut(), which is also used by
+# "pipeline.py" to cut and extract the showers in a single pass.
+#
+# The files can be cut in parallel with the --jobs option, e.g.
+#   ./quality_cuts.py --jobs 16
+#
+# The cutflow (how many frames pass each cut, and the time spent reading,
+# cutting and writing) is saved as json for every file in ./data/i3files/cutflow
+# and for the whole run in ./data/i3files/cutflow.json (see "Cutflow.py")
+
 import numpy as np
-from numpy.linalg import norm
 import glob
 import os
+import time
+import argparse
+from multiprocessing import Pool
+
+from FileManifest import FileManifest, file_info, make_dirs
+from Cutflow import Cutflow
+from ShowerStore import save_columns, load_columns, replace_store
+from ShowerClass import flatten_pulses
+from GeometryCache import load_geometry_table
 
 from icecube.dataio import I3File
 from icecube import icetray, dataclasses, recclasses,simclasses
@@ -11,180 +31,609 @@ from icecube import icetray, dataclasses, recclasses,simclasses
 #data files location
 data_location = '/cr/data01/hagne/John_project/Donghwa/'
 # where to save the frames that passed the quality cuts
-cut_location = "./data/i3files"
+cut_location = "./data/i3files/"
+# geometry file
+geom_location = "GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz"
 
-# get geometry info
-geom_file  = I3File("GeoCalibDetectorStatus_2012.56063_V1_OctSnow.i3.gz")
-geom_frame = geom_file.pop_frame()
-geometry   = geom_frame['I3Geometry']
-geom_file.close()
-iron_energy   = []
-proton_energy = []
+# the frame objects that the showers need
+REQUIRED_KEYS = ['MCPrimary',
+                 'OfflineIceTopHLCVEMPulses',
+                 'OfflineIceTopSLCVEMPulses',
+                 'MCPrimaryInfo',
+                 'IceTopComponentPulses_Muon',
+                 'IceTopComponentPulses_Electron',
+                 'IceTopComponentPulses_ElectronFromChargedMesons',
+                 'IceTopComponentPulses_Gamma',
+                 'IceTopComponentPulses_GammaFromChargedMesons',
+                 'IceTopComponentPulses_Hadron']
 
 
-# --------------------------------------------------------------------------
-# Now get the data from the files ------------------------------------------
 
-# list of appropriate files in folder
-files  = glob.glob(data_location + 'Level2*')
+# ------------------------------------------------------------------------------
+# Geometry ---------------------------------------------------------------------
+# ------------------------------------------------------------------------------
 
+# get geometry info, only the DOM positions are needed for the cuts
+# (from the compiled table of the GCD file, see "GeometryCache.py")
+def load_dom_positions():
+    return load_geometry_table(geom_location)['DOMPos']
 
-total_frames = 0 # want to print out how many frames passed
 
-# loop through files
-nfiles = len(files)
-for file_number in range(nfiles):
 
-    file_name = files[file_number]
-    i3f = I3File(file_name)
+# ------------------------------------------------------------------------------
+# Quality cuts -----------------------------------------------------------------
+# ------------------------------------------------------------------------------
 
-    cut_file_name = cut_location + file_name[len(data_location):]
-    cut_file = I3File(cut_file_name, I3File.Writing)
+# The frame objects are only read (deserialized) when a cut needs them, and
+# then kept, so cuts that use the same object don't read it twice
+class LazyFrame:
+
+    def __init__(self,frame):
+        self.frame   = frame
+        self.objects = dict()
+
+    def __contains__(self,key):
+        return key in self.frame
+
+    def __getitem__(self,key):
+        if key not in self.objects:
+            self.objects[key] = self.frame[key]
+        return self.objects[key]
 
+    def pulses(self,key):
+        if key not in self.objects:
+            self.objects[key] = dataclasses.I3RecoPulseSeriesMap.from_frame(
+                                                                self.frame,key)
+        return self.objects[key]
+
+
+
+# The cuts, each takes a LazyFrame and the DOM positions
+
+# Stage 1: cuts on reconstruction params and frame -
+
+# Does the frame have all the modules we want?
+def cut_keys(f,dom_pos):
+    return all(key in f for key in REQUIRED_KEYS)
+
+# core distance inside containment area
+def cut_core(f,dom_pos):
+    laputop = f["LaputopStandard"]
+    xcr = laputop.pos.x
+    ycr = laputop.pos.y
+    cdr = np.sqrt(xcr**2 + ycr**2) # reconstructed core distance
+    return cdr < 400
+
+# shower not too slanted
+def cut_zenith(f,dom_pos):
+    zenr = f["LaputopStandard"].dir.zenith
+    return np.cos(zenr) >= 0.8
+
+# there is a flag for whether 5 stations were triggered
+def cut_sta5(f,dom_pos):
+    return f["QFilterMask"]["IceTopSTA5_12"].condition_passed == True
+
+# strong enough signal at 125m from core
+def cut_s125(f,dom_pos):
+    return f["LaputopStandardParams"].s125 >= 1
+
+# Stage 2: cuts on pulse data ----------------------
+
+# the largest charge is at least 6 VEM, in a DOM within 300m of the center
+def cut_charge(f,dom_pos):
 
-    print "Starting",file_name,"(file",file_number+1,"of",str(nfiles)+")"
+    tcr = f["LaputopStandard"].time # reconstructed core time
 
-    passed_frames = 0 # how many frames passed the cuts
-    
-    while i3f.more():
+    # HLC and SLC pulses, only take pulses within 1 micro sec of core
+    pulses = flatten_pulses([f.pulses('OfflineIceTopHLCVEMPulses'),
+                             f.pulses('OfflineIceTopSLCVEMPulses')])
+    near   = np.abs(tcr - pulses['time']) <= 1000
+    if not near.any():
+        return False
+
+    # charges, and distances of the DOMs from the center of IceTop
+    all_charges = pulses['charge'][near]
+    pos         = dom_pos[pulses['string'][near],pulses['om'][near]]
+    all_dist    = np.sqrt(pos[:,0]**2 + pos[:,1]**2)
+
+    max_charge      = all_charges.max()
+    max_charge_dist = all_dist[np.argmax(all_charges)]
+    return max_charge >= 6 and max_charge_dist <= 300
+
+
+# The cuts in the order they are applied, cheapest first: checking the keys
+# doesn't read anything, then the small reconstructed particle, the filter
+# mask, the Laputop parameters, and last the pulses.
+# Most frames fail one of the first cuts, so the rest is never read.
+CUTS = [('keys',   cut_keys),
+        ('core',   cut_core),
+        ('zenith', cut_zenith),
+        ('STA5',   cut_sta5),
+        ('S125',   cut_s125),
+        ('charge', cut_charge)]
+
+
+
+# This function applies the cuts in order and stops at the first that fails
+# dom_pos is the array of DOM positions (see "GeometryCache.py")
+# Returns the index (in CUTS) of that cut, or len(CUTS) if all of them passed
+# If a Cutflow is given, the frames that pass each cut and the time spent in
+# each cut are added to it
+def first_failed_cut(frame,dom_pos,cutflow=None):
+    f = LazyFrame(frame)
+    for i in range(len(CUTS)):
+        name, cut = CUTS[i]
+        if cutflow is None:
+            passed = cut(f,dom_pos)
+        else:
+            with cutflow.timer(name):
+                passed = cut(f,dom_pos)
+        if not passed:
+            return i
+        if cutflow is not None:
+            cutflow.count(name)
+    return len(CUTS)
+
+
+
+# ------------------------------------------------------------------------------
+# Cut variable table -----------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# With --cut-table, the variables the cuts are based on are saved for every
+# IceTop frame, together with where the frame is (input file and the number of
+# physics frames before it in that file). New thresholds can then be tried
+# with apply_cuts() on the table in milliseconds, instead of a full pass over
+# the raw data, and read_frames() reads back only the frames that pass.
+#
+# table, files = load_cut_table()
+# mask = apply_cuts(table,core_max=300)
+# for i in np.where(mask)[0]: ... files[table['FileIndex'][i]], table['Frame'][i]
+
+CUT_VARIABLES = ['CoreDist','CosZen','S125','STA5','Keys','MaxCharge',
+                 'MaxChargeDist']
+
+# the thresholds of the quality cuts
+CUT_DEFAULTS = {'core_max':      400, # core distance < 400m
+                'coszen_min':    0.8, # cos(zenith) >= 0.8
+                's125_min':      1,   # S125 >= 1
+                'charge_min':    6,   # max charge >= 6 VEM
+                'charge_dist':   300} # max charge within 300m of the center
+
+# Keys has bit i set if REQUIRED_KEYS[i] is in the frame
+ALL_KEYS = 2**len(REQUIRED_KEYS) - 1
+
+# the types of the columns of the table
+TABLE_TYPES = dict((name,float) for name in CUT_VARIABLES)
+TABLE_TYPES.update(Frame=int,Run=int,Event=int,Keys=int)
+
+# where the table is saved
+table_location = "./data/cut_table/"
+# where the event list is saved (see --event-list below)
+event_location = "./data/event_list/"
+
+
+
+# This function calculates all the cut variables of a frame, without stopping
+# at a failed cut. Variables that can't be calculated are NaN.
+def cut_variables(frame,dom_pos):
+
+    f = LazyFrame(frame)
+    v = dict((name,np.nan) for name in CUT_VARIABLES)
+
+    v['Keys'] = sum(2**i for i in range(len(REQUIRED_KEYS))
+                                            if REQUIRED_KEYS[i] in f)
+
+    if "LaputopStandard" in f:
+        laputop = f["LaputopStandard"]
+        v['CoreDist'] = np.sqrt(laputop.pos.x**2 + laputop.pos.y**2)
+        v['CosZen']   = np.cos(laputop.dir.zenith)
+    if "LaputopStandardParams" in f:
+        v['S125'] = f["LaputopStandardParams"].s125
+    if "QFilterMask" in f:
+        v['STA5'] = float(f["QFilterMask"]["IceTopSTA5_12"].condition_passed)
+
+    if "LaputopStandard" in f and 'OfflineIceTopHLCVEMPulses' in f and \
+    'OfflineIceTopSLCVEMPulses' in f:
+        tcr    = f["LaputopStandard"].time
+        pulses = flatten_pulses([f.pulses('OfflineIceTopHLCVEMPulses'),
+                                 f.pulses('OfflineIceTopSLCVEMPulses')])
+        near   = np.abs(tcr - pulses['time']) <= 1000
+        if near.any():
+            all_charges = pulses['charge'][near]
+            pos         = dom_pos[pulses['string'][near],pulses['om'][near]]
+            all_dist    = np.sqrt(pos[:,0]**2 + pos[:,1]**2)
+            v['MaxCharge']     = all_charges.max()
+            v['MaxChargeDist'] = all_dist[np.argmax(all_charges)]
+
+    return v
+
+
+
+# This function gives the mask of the frames that pass each of the quality
+# cuts on their own, as a list of (name, mask) in the order of CUTS.
+# It works on a cut table or on the variables of one frame, with the
+# thresholds in CUT_DEFAULTS unless given.
+def cut_flags(table,**cuts):
+
+    c = dict(CUT_DEFAULTS)
+    c.update(cuts)
+
+    # NaN (missing) variables fail the cuts
+    with np.errstate(invalid='ignore'):
+        return [('keys',   np.asarray(table['Keys']) == ALL_KEYS),
+                ('core',   np.asarray(table['CoreDist']) < c['core_max']),
+                ('zenith', np.asarray(table['CosZen']) >= c['coszen_min']),
+                ('STA5',   np.asarray(table['STA5']) == 1),
+                ('S125',   np.asarray(table['S125']) >= c['s125_min']),
+                ('charge', (np.asarray(table['MaxCharge']) >= c['charge_min']) &
+                    (np.asarray(table['MaxChargeDist']) <= c['charge_dist']))]
+
+
+
+# This function applies the quality cuts to a cut table (or to the variables
+# of one frame), see cut_flags(). Returns the mask of the frames that pass.
+# If a Cutflow is given, the frames that pass each cut (and all the ones
+# before it) are added to it
+def apply_cuts(table,cutflow=None,**cuts):
+    flags  = cut_flags(table,**cuts)
+    passed = flags[0][1]
+    for name, mask in flags:
+        passed = passed & mask
+        if cutflow is not None:
+            cutflow.count(name,int(np.sum(passed)))
+    return passed
+
+
+
+# This function joins the per-file tables of the input files (kept in
+# cut_location+folder) into one table saved in 'location'.
+# Files.npy holds the input files, and the FileIndex column points to it.
+def join_tables(files,folder,location,names):
+
+    tables = []
+    for i in range(len(files)):
+        table = load_columns(table_path(files[i],folder),mmap=False)
+        table['FileIndex'] = np.zeros(len(table['Frame']),dtype=int) + i
+        tables.append(table)
+
+    columns = dict()
+    for name in ['FileIndex'] + names:
+        columns[name] = np.concatenate([t[name] for t in tables]) \
+                                                if len(tables) > 0 else []
+    columns['Files'] = np.array(files,dtype=bytes)
+
+    tmp_path = location.rstrip('/') + ".tmp"
+    save_columns(tmp_path,columns)
+    replace_store(tmp_path,location.rstrip('/'))
+
+
+
+# This function loads a joined table, and the list of input files
+def load_table(path):
+    table = load_columns(path)
+    files = [f.decode() if not isinstance(f,str) else f for f in table['Files']]
+    return table, files
+
+def load_cut_table(path=table_location):
+    return load_table(path)
+
+
+
+# where the table of one input file is kept
+def table_path(file_name,folder="tables/"):
+    return cut_location + folder + os.path.basename(file_name)
+
+# where the cutflow of one input file is kept
+def cutflow_path(file_name):
+    return cut_location + "cutflow/" + os.path.basename(file_name) + ".json"
+
+
+
+# This function reads back the physics frames with the given numbers (the
+# 'Frame' column of the cut table) from an input file, in file order.
+# It stops reading after the last one it needs.
+def read_frames(file_name,frame_numbers):
+    wanted = set(int(n) for n in frame_numbers)
+    if len(wanted) == 0:
+        return
+    last = max(wanted)
+    i3f = I3File(file_name)
+    n = 0
+    while i3f.more() and n <= last:
         frame = i3f.pop_physics()
-        header = frame["I3EventHeader"]
-        if header.sub_event_stream == "ice_top":
-
-            run = header.run_id
-            event = header.event_id
-
-            # Apply quality cuts -------------------------------
-            # Stage 1: cuts on reconstruction params and frame -
-
-            laputop = frame["LaputopStandard"]
-            xcr = laputop.pos.x
-            ycr = laputop.pos.y
-            cdr = np.sqrt(xcr**2 + ycr**2) # reconstructed core distance
-            zenr = laputop.dir.zenith
-            S125 = frame["LaputopStandardParams"].s125
-
-            tcr = laputop.time # reconstructed core time, needed later
-
-            # there is one more cut I can apply before looking at pulses
-            # there is a flag for whether 5 stations were triggered
-            five_stations_triggered = frame["QFilterMask"]["IceTopSTA5_12"].condition_passed
-
-            quality_flag = [0,0,0,0,0]
-            if cdr < 400: # core distance inside containment area
-                quality_flag[0] = 1
-            if np.cos(zenr) >= 0.8: # shower not too slanted
-                quality_flag[1] = 1
-            if S125 >= 1: # strong enough signal at 125m from core
-                quality_flag[2] = 1
-            if five_stations_triggered == True: # five stations triggered
-                quality_flag[3] = 1
-            if ('MCPrimary' in frame and  # Does the frame have all the modules we want?
-                'OfflineIceTopHLCVEMPulses' in frame and
-                'OfflineIceTopSLCVEMPulses' in frame and
-                'MCPrimaryInfo' in frame and
-                'IceTopComponentPulses_Muon' in frame and
-                'IceTopComponentPulses_Electron' in frame and
-                'IceTopComponentPulses_ElectronFromChargedMesons' in frame and
-                'IceTopComponentPulses_Gamma' in frame and
-                'IceTopComponentPulses_GammaFromChargedMesons' in frame and
-                'IceTopComponentPulses_Hadron' in frame):
-                quality_flag[4] = 1
-
-
-            if sum(quality_flag) == 5: # does the event pass all of the previous cuts?
-
-                # Apply quality cuts -------------------------------
-                # Stage 2: cuts on pulse data ----------------------
-
-                # --------------------
-                # HLC tanks ----------
-                # --------------------
-                events_HLC  = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,'OfflineIceTopHLCVEMPulses')
-                oms_HLC     = []
-                strings_HLC = []
-                charges_HLC = []
-                times_HLC   = []
-                dist_HLC    = []
-                latdist_HLC = []
-
-                # pulse data --
-                for key, pulses in events_HLC:
-                    for p in pulses:
-                        if np.abs(tcr - p.time) <= 1000: # only take events within 1 micro sec of core
-                            oms_HLC.append(key.om) # tank/PMT id
-                            strings_HLC.append(key.string) # station id
-                            charges_HLC.append(p.charge) # charge deposited
-
-                # distances --
-                omkey_HLC = [icetray.OMKey(strings_HLC[i],oms_HLC[i]) for i in range(len(strings_HLC))]
-                for i in range(len(strings_HLC)):
-                    xi   = geometry.omgeo[omkey_HLC[i]].position.x 
-                    yi   = geometry.omgeo[omkey_HLC[i]].position.y 
-                    d = np.sqrt(xi**2 + yi**2)
-
-                    dist_HLC.append(d)
-
-                # --------------------
-                # SLC tanks ----------
-                # --------------------
-                events_SLC  = dataclasses.I3RecoPulseSeriesMap.from_frame(frame,'OfflineIceTopSLCVEMPulses')
-                oms_SLC     = []
-                strings_SLC = []
-                charges_SLC = []
-                times_SLC   = []
-                dist_SLC    = []
-                latdist_SLC = []
-
-                # pulse data --
-                for key, pulses in events_SLC:
-                    for p in pulses:
-                        if np.abs(tcr - p.time) <= 1000: # only take events within 1 micro sec of core
-                            oms_SLC.append(key.om) # tank/PMT id
-                            strings_SLC.append(key.string) # station id
-                            charges_SLC.append(p.charge) # charge deposited
-
-                # distances --
-                omkey_SLC = [icetray.OMKey(strings_SLC[i],oms_SLC[i]) for i in range(len(strings_SLC))]
-                for i in range(len(strings_SLC)):
-                    xi   = geometry.omgeo[omkey_SLC[i]].position.x 
-                    yi   = geometry.omgeo[omkey_SLC[i]].position.y 
-                    d = np.sqrt(xi**2 + yi**2)
-
-                    dist_SLC.append(d)
-
-                all_charges = np.append(charges_HLC,charges_SLC)
-                all_dist    = np.append(dist_HLC,dist_SLC)
-
-                max_charge      = max(all_charges)
-                max_charge_dist = all_dist[np.argmax(all_charges)]
-                if max_charge >= 6 and max_charge_dist <= 300:
-                    # this frame passed all the quality cuts
-                    passed_frames += 1
-                    total_frames += 1
-
-                    # add it to the cut file
-                    # ------------------------------------
-                    # what frames does this frame rely on?
-                    parents = i3f.get_mixed_frames()
-                    for P in parents:
-                        cut_file.push(P)
-                    # save the frame to the file
-                    cut_file.push(frame)
-
-    cut_file.close()
-    if passed_frames == 0: # we don't need the file if it doesn't contain any frames!
-        os.system("rm {0}".format(cut_file_name))
-
-    #os.system("rm {0}".format(file_name)) # remove the original data file
-
-print "-------------------------"
-print total_frames,"frames passed the cut"
+        if n in wanted:
+            yield frame
+        n += 1
+    i3f.close()
+
+
+
+# ------------------------------------------------------------------------------
+# Event list -------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# With --event-list, no I3 files are written. Instead the frames that pass are
+# saved in a compact event list: the input file, the number of the frame in
+# it (physics frames only), run and event. Showers.py --event-list reads the
+# frames straight from the input files, see read_frames().
+# Frames are located by number rather than byte offset, because I3File can't
+# seek to a byte offset; frames before a wanted one are skipped without
+# reading any of their objects.
+
+EVENT_COLUMNS = ['Frame','Run','Event']
+
+def load_event_list(path=event_location):
+    return load_table(path)
+
+# This function gives the frames of the event list per input file
+def event_list_frames(path=event_location):
+    events, files = load_event_list(path)
+    frames = dict()
+    for i in range(len(files)):
+        frames[files[i]] = np.asarray(events['Frame'])[events['FileIndex'] == i]
+    return frames
+
+
+
+# ------------------------------------------------------------------------------
+# Filtered I3 files ------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+# This writer only writes each parent frame (Geometry, Calibration,
+# DetectorStatus, DAQ, ...) once. Every non-physics frame read from the input
+# is given to parent(); it is held back until a physics frame that passed is
+# pushed, and then written just before it. Parent frames that are already in
+# the output file are not written again, and parents that were replaced in
+# the input before any frame needed them are never written.
+# The frames are written to a hidden temporary file first (same extension, so
+# the same compression), which only gets the final name 'file_name' when it
+# is closed, and only if a physics frame was pushed. Otherwise it is deleted,
+# together with a file of that name left over from an earlier run, so a crash
+# never leaves a partial file under the final name.
+class FilteredWriter:
+
+    def __init__(self,file_name):
+        self.file_name = file_name
+        self.tmp_name  = os.path.join(os.path.dirname(file_name),
+                                        ".tmp_"+os.path.basename(file_name))
+        self.out       = I3File(self.tmp_name, I3File.Writing)
+        self.pending   = [] # parent frames not written yet, in input order
+        self.frames    = 0  # physics frames written
+
+    def parent(self,frame):
+        # a new frame of the same stop replaces the one that is pending
+        self.pending = [P for P in self.pending if P.Stop != frame.Stop]
+        self.pending.append(frame)
+
+    def push(self,frame):
+        for P in self.pending:
+            self.out.push(P)
+        self.pending = []
+        self.out.push(frame)
+        self.frames += 1
+
+    def close(self):
+        self.out.close()
+        if self.frames > 0:
+            os.rename(self.tmp_name,self.file_name)
+        else: # we don't need the file if it doesn't contain any frames!
+            os.remove(self.tmp_name)
+            if os.path.isfile(self.file_name): # left over from an earlier run
+                os.remove(self.file_name)
 
 
 
+# ------------------------------------------------------------------------------
+# Cut one file -----------------------------------------------------------------
+# ------------------------------------------------------------------------------
 
+# the DOM positions, whether to make the cut table, and whether to write an
+# event list instead of I3 files, set by setup() in every process
+dom_pos     = None
+make_table  = False
+make_events = False
 
+# this is also the initializer of the worker processes
+def setup(table=False,events=False):
+    global dom_pos, make_table, make_events
+    dom_pos     = load_dom_positions()
+    make_table  = table
+    make_events = events
 
 
 
+# The counts of the cutflow: the IceTop frames seen, the frames that pass each
+# cut (and all the ones before it), and the frames written to the output
+# (the I3 file or the event list)
+CUTFLOW_COUNTS = ['seen'] + [name for name, cut in CUTS] + ['written']
+
+
+
+# This function applies the cuts to one file and returns its cutflow (as a
+# dictionary, see "Cutflow.py"), which is also saved in cutflow_path(), and
+# the file_info() of the file for the manifest (see "FileManifest.py")
+def cut_file(args):
+
+    file_number, nfiles, file_name = args
+
+    print "Starting",file_name,"(file",file_number+1,"of",str(nfiles)+")"
+
+    cut_file_name = cut_location + file_name[len(data_location):]
+
+    cutflow = Cutflow(CUTFLOW_COUNTS)
+    start   = time.time()
+    info    = file_info(file_name)
+
+    i3f = I3File(file_name)
+    out = None
+    if not make_events:
+        out = FilteredWriter(cut_file_name)
+
+    # the cut table and the event list of this file
+    table  = dict((name,[]) for name in EVENT_COLUMNS + CUT_VARIABLES)
+    events = dict((name,[]) for name in EVENT_COLUMNS)
+
+    frame_number = -1 # counts the physics frames
+    while i3f.more():
+        with cutflow.timer('read'):
+            frame = i3f.pop_frame()
+        if frame.Stop != icetray.I3Frame.Physics:
+            # the frames the physics frames rely on
+            if out is not None:
+                out.parent(frame)
+            continue
+        frame_number += 1
+        header = frame["I3EventHeader"]
+        if header.sub_event_stream != "ice_top":
+            continue
+        cutflow.count('seen')
+
+        if make_table:
+            # all the variables, the cuts are applied to them
+            with cutflow.timer('variables'):
+                variables = cut_variables(frame,dom_pos)
+            variables.update(Frame=frame_number,Run=header.run_id,
+                                                    Event=header.event_id)
+            for name in table:
+                table[name].append(variables[name])
+            passed = apply_cuts(variables,cutflow)
+        else:
+            passed = first_failed_cut(frame,dom_pos,cutflow) == len(CUTS)
+
+        if passed:
+            # this frame passed all the quality cuts
+            cutflow.count('written')
+
+            if make_events:
+                events['Frame'].append(frame_number)
+                events['Run'].append(header.run_id)
+                events['Event'].append(header.event_id)
+                continue
+
+            # add it to the cut file, with the frames it relies on that
+            # are not in the file yet
+            with cutflow.timer('write'):
+                out.push(frame)
+
+    i3f.close()
+
+    # the cut file gets its final name, or is removed if no frame passed
+    with cutflow.timer('write'):
+        if out is not None:
+            out.close()
+
+    if make_events:
+        save_columns(table_path(file_name,"events/"),
+                     dict((name,np.array(events[name],dtype=int))
+                                                        for name in events))
+
+    if make_table:
+        save_columns(table_path(file_name),
+                     dict((name,np.array(table[name],dtype=TABLE_TYPES[name]))
+                                                        for name in table))
+
+    #os.remove(file_name) # remove the original data file
+
+    cutflow.add_time('total',time.time() - start)
+    make_dirs(os.path.dirname(cutflow_path(file_name)))
+    cutflow.save(cutflow_path(file_name),file=file_name,table=make_table,
+                                                        events=make_events)
+
+    return cutflow.to_dict(), info
+
+
+
+# ------------------------------------------------------------------------------
+# MAIN -------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Apply the quality cuts to "+
+                                        "the I3 files in "+data_location)
+    parser.add_argument('--jobs',type=int,default=1,
+                        help="number of files processed in parallel")
+    parser.add_argument('--cut-table',action='store_true',
+                        help="save the cut variables of every frame in "+
+                             table_location)
+    parser.add_argument('--event-list',action='store_true',
+                        help="save a list of the frames that pass in "+
+                             event_location+" instead of writing I3 files")
+    args = parser.parse_args()
+
+    # remembers which input files are done, so a rerun only does new/changed files
+    manifest = FileManifest(cut_location + "manifest.json")
+
+    # list of appropriate files in folder
+    files  = sorted(glob.glob(data_location + 'Level2*'))
+
+    total_frames = 0 # want to print out how many frames passed
+
+    # the cutflow of the whole run, the files that are skipped add the
+    # cutflow of when they were cut
+    cutflow = Cutflow(CUTFLOW_COUNTS)
+    start   = time.time()
+
+    # skip the files that did not change since they were last cut
+    todo = []
+    for file_name in files:
+        if manifest.up_to_date(file_name) and \
+        (manifest.get(file_name).get('table',False) or not args.cut_table) and \
+        manifest.get(file_name).get('events',False) == args.event_list:
+            total_frames += manifest.get(file_name)['passed']
+            if os.path.isfile(cutflow_path(file_name)):
+                cutflow.merge(Cutflow.load(cutflow_path(file_name)))
+            print "Skipping",file_name,"(unchanged)"
+        else:
+            todo.append(file_name)
+
+    nfiles = len(todo)
+    tasks  = [(i,nfiles,todo[i]) for i in range(nfiles)]
+
+    # compile the geometry table once, before the workers load it
+    load_geometry_table(geom_location)
+
+    # loop through files, the pass counts come back in file order
+    if args.jobs > 1:
+        pool    = Pool(args.jobs,initializer=setup,
+                            initargs=(args.cut_table,args.event_list))
+        results = iter(pool.imap(cut_file,tasks,chunksize=1))
+    else:
+        setup(args.cut_table,args.event_list)
+        results = (cut_file(task) for task in tasks)
+
+    for file_name in todo:
+        file_cutflow, info = next(results)
+        passed_frames = file_cutflow['counts']['written']
+        total_frames += passed_frames
+        cutflow.merge(file_cutflow)
+
+        manifest.record(file_name,info,passed=passed_frames,
+                        table=args.cut_table,events=args.event_list)
+        manifest.save()
+
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+
+    if args.cut_table:
+        join_tables(files,"tables/",table_location,EVENT_COLUMNS+CUT_VARIABLES)
+    if args.event_list:
+        join_tables(files,"events/",event_location,EVENT_COLUMNS)
+
+    # the times of the files add up the time of every worker, 'run' is the
+    # wall time of this run
+    cutflow.add_time('run',time.time() - start)
+    cutflow.save(cut_location + "cutflow.json",files=len(files),
+                 processed=len(todo),jobs=args.jobs,table=args.cut_table,
+                 events=args.event_list)
+
+    print "-------------------------"
+    print cutflow.summary()
+    print "-------------------------"
+    print total_frames,"frames passed the cut"
+
+
+if __name__ == '__main__':
+    main()
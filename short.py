@@ -6,32 +6,28 @@
 
 import numpy as np
 
+from ShowerStore import load_showers, save_store, select_rows
+from Selection import Selection
+
 
 #load the data
 data_location = './data/'
-protondata = np.load(data_location+"proton_showers.npy")
-irondata   = np.load(data_location+"iron_showers.npy")
-
-protonshort = []
-ironshort   = []
+protondata = load_showers(data_location+"proton_showers")
+irondata   = load_showers(data_location+"iron_showers")
 
-for shower in protondata:
-    logE = np.log10(shower.Primary.Energy)
-    if logE >= 16.5 and logE <= 17.0:
-        protonshort.append(shower)
+protonsel = Selection(protondata)
+ironsel   = Selection(irondata)
 
-for shower in irondata:
-    logE = np.log10(shower.Primary.Energy)
-    if logE >= 16.5 and logE <= 17.0:
-        ironshort.append(shower)
+protonshort = select_rows(protonsel.columns,protonsel.window("logE",16.5,17.0))
+ironshort   = select_rows(ironsel.columns,ironsel.window("logE",16.5,17.0))
 
 
 # save the data
 
 save_location = './data/'
 
-np.save(save_location+'proton_showers_short.npy',protonshort)
-np.save(save_location+'iron_showers_short.npy',ironshort)
+save_store(save_location+'proton_showers_short',protonshort)
+save_store(save_location+'iron_showers_short',ironshort)
 
 
-print len(protonshort),len(ironshort)
+print len(protonshort['Run']),len(ironshort['Run'])